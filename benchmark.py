@@ -0,0 +1,237 @@
+#!/usr/bin/python
+# Scalability benchmark: generate synthetic libraries of increasing size and measure
+# how long it takes, and how much memory it needs, to write, parse and render them.
+#
+# The libraries are made with the normal generators from randomized IPC names: QFPs
+# with up to 256 pins, SOPs and BGAs with up to 1600 balls. Each stage runs in its
+# own process so that its peak RSS can be measured on its own.
+#
+# Example:
+#   ./benchmark.py --sizes 1000,10000 --plot scaling.png
+#
+
+import optparse
+import os
+import sys
+import time
+import math
+import random
+import shutil
+import tempfile
+import resource
+import traceback
+import multiprocessing
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+import footprinter
+import modfile
+
+stages = ("write-mod", "write-pretty", "parse", "render")
+
+def synthetic_names(count, seed=0):
+    """Return count random IPC names of QFP, SOP and BGA packages"""
+    rnd = random.Random(seed)
+    names = []
+    for i in range(0, count):
+        kind = rnd.random()
+        if kind < 0.4:
+            pitch = rnd.choice((0.40, 0.50, 0.65, 0.80))
+            pins_per_side = rnd.randint(5, 64)
+            span = int(math.ceil(pins_per_side * pitch + 1.0)) + 2
+            name = "QFP%dP%dX%d-%d" % (round(pitch * 100), span * 100, span * 100, pins_per_side * 4)
+        elif kind < 0.7:
+            (pitch, span) = rnd.choice(((1.27, 6.00), (1.27, 10.30), (0.65, 7.80), (0.65, 6.40)))
+            name = "%s%dP%d-%d" % ("SOIC" if pitch == 1.27 else "SOP", round(pitch * 100),
+                                   round(span * 100), rnd.randint(2, 24) * 2)
+        else:
+            pitch = rnd.choice((0.50, 0.65, 0.80, 1.00))
+            n = rnd.randint(6, 40)
+            body = int(math.ceil((n - 1) * pitch + 2.0))
+            name = "BGA%dC%dP%dX%d_%dX%d" % (n * n, round(pitch * 100), n, n, body * 100, body * 100)
+        names.append(name + rnd.choice("LNM"))
+    return names
+
+def generate(name):
+    generator = footprinter.make_generator(name)
+    generator.parse_ipc_name(name)
+    return generator.stream()
+
+def module_name(name, i):
+    return "%s_%d" % (name, i)
+
+def run_write_mod(names, directory):
+    f = open(os.path.join(directory, "lib.mod"), "w")
+    f.write("PCBNEW-LibModule-V1  %s\n" % time.asctime())
+    f.write("$INDEX\n")
+    for (i, name) in enumerate(names):
+        f.write("%s\n" % module_name(name, i))
+    f.write("$EndINDEX\n")
+    for (i, name) in enumerate(names):
+        footprinter.make_emp(f, module_name(name, i), generate(name), False)
+    f.write("$EndLIBRARY\n")
+    f.close()
+
+def run_write_pretty(names, directory):
+    pretty = os.path.join(directory, "lib.pretty")
+    if not os.path.isdir(pretty):
+        os.makedirs(pretty)
+    for (i, name) in enumerate(names):
+        f = open(os.path.join(pretty, module_name(name, i) + ".kicad_mod"), "w")
+        footprinter.make_kicad_mod(f, module_name(name, i), generate(name))
+        f.close()
+
+def run_parse(names, directory):
+    mod = modfile.Mod(os.path.join(directory, "lib.mod"))
+    mod.read_index()
+    mod.parse()
+    assert len(mod.mods) == len(names)
+
+def run_render(names, directory):
+    out = open(os.devnull, "wb")
+    for name in names:
+        footprinter.make_tiled_png(out, 4, generate(name))
+    out.close()
+
+def measure(stage, names, directory, results):
+    """Run a stage and put (seconds, peak RSS in MB) on the results queue, or the
+    error message if the stage fails"""
+    start = time.time()
+    try:
+        globals()["run_" + stage.replace("-", "_")](names, directory)
+    except Exception:
+        results.put(traceback.format_exc().strip().splitlines()[-1])
+        return
+    elapsed = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        rss *= 1024 # kB on Linux, bytes on macOS
+    results.put((elapsed, rss / 1e6))
+
+def run_stage(stage, names, directory):
+    """Run a stage in its own process. Returns (seconds, peak RSS in MB), raises
+    RuntimeError if the stage fails or the process dies."""
+    results = multiprocessing.Queue()
+    p = multiprocessing.Process(target=measure, args=(stage, names, directory, results))
+    p.start()
+    r = None
+    while r is None:
+        try:
+            r = results.get(timeout=1)
+        except Empty:
+            if not p.is_alive():
+                # The result may have been sent just before the process exited
+                try:
+                    r = results.get(timeout=1)
+                except Empty:
+                    r = "process exited with code %s" % p.exitcode
+    p.join()
+    if not isinstance(r, tuple):
+        raise RuntimeError(r)
+    return r
+
+def plot(results, sizes, filename):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    (fig, (ax1, ax2)) = plt.subplots(1, 2, figsize=(11, 4.5))
+    for stage in stages:
+        points = [ (n, results[(stage, n)]) for n in sizes if (stage, n) in results ]
+        if not points:
+            continue
+        ax1.loglog([ p[0] for p in points ], [ p[1][0] for p in points ], "o-", label=stage)
+        ax2.semilogx([ p[0] for p in points ], [ p[1][1] for p in points ], "o-", label=stage)
+    ax1.set_xlabel("modules")
+    ax1.set_ylabel("wall time [s]")
+    ax2.set_xlabel("modules")
+    ax2.set_ylabel("peak RSS [MB]")
+    ax1.legend()
+    ax1.grid(True, which="both")
+    ax2.grid(True, which="both")
+    fig.tight_layout()
+    fig.savefig(filename)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="Usage: %prog [options]",
+                                   description="Measure library write, parse and render scaling")
+    parser.add_option("--sizes", dest="sizes", default="1000,10000,100000",
+                      help="Comma separated library sizes [modules]", metavar="N,N,...")
+    parser.add_option("--stages", dest="stages", default=",".join(stages),
+                      help="Comma separated stages to run: %s" % ", ".join(stages), metavar="STAGES")
+    parser.add_option("--seed", dest="seed", type="int", default=0,
+                      help="Random seed for the synthetic libraries", metavar="N")
+    parser.add_option("--dir", dest="directory",
+                      help="Directory for the libraries (default: temporary, removed afterwards)",
+                      metavar="DIR")
+    parser.add_option("--csv", dest="csv",
+                      help="Write results as CSV to this file", metavar="FILE")
+    parser.add_option("--plot", dest="plot",
+                      help="Plot the scaling curves to this image file (needs matplotlib)",
+                      metavar="FILE")
+    (options, args) = parser.parse_args()
+
+    sizes = [ int(n) for n in options.sizes.split(",") ]
+    selected = options.stages.split(",")
+    for stage in selected:
+        if stage not in stages:
+            parser.error("Unknown stage %s" % stage)
+    if "parse" in selected and "write-mod" not in selected and options.directory is None:
+        parser.error("parse needs write-mod, or --dir with libraries from an earlier run")
+    if options.plot:
+        try:
+            import matplotlib
+        except ImportError:
+            parser.error("--plot needs matplotlib")
+
+    results = {}
+    failed = 0
+    print("%-13s %8s %10s %10s %10s" % ("stage", "modules", "time [s]", "us/module", "RSS [MB]"))
+    for n in sizes:
+        names = synthetic_names(n, options.seed)
+        if options.directory:
+            directory = os.path.join(options.directory, str(n))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        else:
+            directory = tempfile.mkdtemp(prefix="footprinter-bench-")
+        for stage in stages:
+            if stage not in selected:
+                continue
+            try:
+                (elapsed, rss) = run_stage(stage, names, directory)
+            except RuntimeError as e:
+                print("%-13s %8d failed: %s" % (stage, n, e))
+                sys.stdout.flush()
+                failed += 1
+                continue
+            results[(stage, n)] = (elapsed, rss)
+            print("%-13s %8d %10.2f %10.1f %10.1f" % (stage, n, elapsed, elapsed / n * 1e6, rss))
+            sys.stdout.flush()
+        if not options.directory:
+            shutil.rmtree(directory)
+
+    # Report stages where time per module grows with library size
+    for stage in selected:
+        for (a, b) in zip(sizes, sizes[1:]):
+            if (stage, a) in results and (stage, b) in results and results[(stage, a)][0] > 0:
+                exponent = (math.log(results[(stage, b)][0] / results[(stage, a)][0]) /
+                            math.log(float(b) / a))
+                if exponent > 1.2:
+                    print("Warning: %s scales as n^%.2f between %d and %d modules" % (
+                        stage, exponent, a, b))
+
+    if options.csv:
+        f = open(options.csv, "w")
+        f.write("stage,modules,seconds,peak_rss_mb\n")
+        for n in sizes:
+            for stage in stages:
+                if (stage, n) in results:
+                    f.write("%s,%d,%.3f,%.1f\n" % ((stage, n) + results[(stage, n)]))
+        f.close()
+
+    if options.plot:
+        plot(results, sizes, options.plot)
+    sys.exit(1 if failed else 0)
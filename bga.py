@@ -0,0 +1,218 @@
+# Generate ball grid array (BGA) package footprints
+#
+# The ball grid is built with NumPy in one go rather than one pad object at a time,
+# so packages with a couple of thousand balls are still quick to generate.
+#
+# Rows are lettered according to JEDEC JEP95 (A, B, ..., Y, AA, AB, ...), skipping
+# the letters I, O, Q, S, X and Z. Ball A1 is in the upper-left (negative X,
+# negative Y) corner.
+#
+import re
+import copy
+import numpy
+from common import PackageStream, Line, Rectangle, PadArray, batch_size
+
+# Row letters allowed by JEDEC JEP95
+row_letters = "ABCDEFGHJKLMNPRTUVWY"
+
+def row_name(row):
+    """Return the JEDEC name of the zero-based row number (A, B, ..., Y, AA, AB, ...)"""
+    n = len(row_letters)
+    name = ""
+    row += 1
+    while row > 0:
+        row -= 1
+        name = row_letters[row % n] + name
+        row //= n
+    return name
+
+class Params(object):
+    pass
+
+class Bga(object):
+    def __init__(self):
+        self.params = Params()
+        self.params.density = "N"      # IPC-7351 density level (L, N or M)
+        self.params.balldiameter = None # [mm] nominal ball diameter
+        self.params.collapsing = True  # collapsing (C) or non-collapsing (N) balls
+        self.params.silkwidth = 0.15   # [mm] silkscreen line width and clearance
+        self.params.pitch = None       # [mm] ball pitch (distance between ball centers)
+        self.params.cols = None        # number of columns (X dimension)
+        self.params.rows = None        # number of rows (Y dimension)
+        self.params.l1 = None          # [mm] package body width, X dimension
+        self.params.l2 = None          # [mm] package body width, Y dimension
+        self.params.pincount = None    # total number of balls on package
+        self.params.depopulated = None # names of missing balls (like ["A1", "B2"]), or
+                                       # a rows*cols boolean array that is True for balls
+
+    def parse_ipc_name(self, name):
+        """Parse IPC name (like BGA256C100P16X16_1700X1700X160) and set parameters from it"""
+
+        match = re.match("BGA(\d+)(C|N)(\d+)P(\d+)X(\d+)_(\d+)X(\d+)(X\d+)?(.)?", name)
+
+        if match is None:
+            return None
+
+        p = self.params
+        p.pincount = int(match.group(1))
+        p.collapsing = match.group(2) == "C"
+        p.pitch = int(match.group(3)) / 100.0
+        p.cols = int(match.group(4))
+        p.rows = int(match.group(5))
+        p.l1 = int(match.group(6)) / 100.0
+        p.l2 = int(match.group(7)) / 100.0
+        if match.group(9) is not None:
+            p.density = match.group(9)
+        self.recalculate_params()
+
+    def set_density(self, density):
+        """Set parameters for density level L, N or M"""
+        self.params.density = density
+        self.recalculate_params()
+
+    def recalculate_params(self):
+        """Recalculate land size depending on ball size and density level"""
+        params = self.params
+        if params.density == "0": # No courtyard excess at all (for debugging)
+            params.courtyard_excess = 0
+        elif params.density == "L": # Least density level
+            params.courtyard_excess = 0.50
+        elif params.density == "N": # Nominal density level
+            params.courtyard_excess = 1.00
+        elif params.density == "M": # Most density level
+            params.courtyard_excess = 2.00
+        else:
+            raise ValueError("Invalid density (need L,N or M)")
+
+        if params.balldiameter is None:
+            # Typical ball sizes for each pitch, JEDEC JEP95
+            if params.pitch >= 1.25:
+                params.balldiameter = 0.75
+            elif params.pitch >= 1.00:
+                params.balldiameter = 0.60
+            elif params.pitch >= 0.75:
+                params.balldiameter = 0.45
+            elif params.pitch >= 0.65:
+                params.balldiameter = 0.35
+            elif params.pitch >= 0.50:
+                params.balldiameter = 0.30
+            else:
+                params.balldiameter = 0.25
+
+        # IPC-7351 land size relative to the nominal ball diameter. Collapsing balls
+        # get a smaller land, non-collapsing balls a slightly larger one.
+        if params.collapsing:
+            if params.balldiameter >= 0.55:
+                params.landratio = 0.75
+            elif params.balldiameter >= 0.40:
+                params.landratio = 0.80
+            else:
+                params.landratio = 0.85
+        else:
+            if params.balldiameter >= 0.55:
+                params.landratio = 1.05
+            else:
+                params.landratio = 1.10
+
+    def ball_mask(self):
+        """Return a rows*cols boolean array that is True where there is a ball"""
+        params = self.params
+        mask = numpy.ones((params.rows, params.cols), dtype=bool)
+        if params.depopulated is not None:
+            if isinstance(params.depopulated, numpy.ndarray):
+                return params.depopulated.astype(bool)
+            names = self.ball_names()
+            for name in params.depopulated:
+                mask[names == name] = False
+        elif params.pincount < params.rows * params.cols:
+            # Assume a centered square void, which is the common case
+            missing = params.rows * params.cols - params.pincount
+            side = int(round(missing ** 0.5))
+            if side * side != missing or (params.rows - side) % 2 or (params.cols - side) % 2:
+                raise ValueError("Can't guess depopulation of %d balls, set params.depopulated" % missing)
+            r0 = (params.rows - side) // 2
+            c0 = (params.cols - side) // 2
+            mask[r0:r0 + side, c0:c0 + side] = False
+        return mask
+
+    def ball_names(self):
+        """Return a rows*cols array of ball names (A1, A2, ...)"""
+        params = self.params
+        rows = numpy.array([ row_name(r) for r in range(0, params.rows) ])
+        cols = numpy.arange(1, params.cols + 1).astype(str)
+        return numpy.char.add(rows[:, numpy.newaxis], cols[numpy.newaxis, :])
+
+    def courtyard(self):
+        """Return the courtyard ((x0, y0), (x1, y1))"""
+        params = self.params
+        courtyardw = params.l1 / 2.0 + params.courtyard_excess
+        courtyardh = params.l2 / 2.0 + params.courtyard_excess
+        return ((-courtyardw, -courtyardh), (courtyardw, courtyardh))
+
+    def stream(self):
+        """Return a PackageStream that generates the data when it is read. It uses a
+        copy of the parameters, so the data matches the courtyard even if the
+        parameters are changed later."""
+        generator = copy.copy(self)
+        generator.params = params = copy.copy(self.params)
+        package = PackageStream(generator.batches)
+        package.description = "BGA-%d, %.02fmm pitch, %dx%d, %.2fx%.2fmm body" % (
+            params.pincount, params.pitch, params.cols, params.rows, params.l1, params.l2)
+        package.courtyard = generator.courtyard()
+        return package
+
+    def generate(self, **kwargs):
+        """Generate data using previously loaded name and parameters. Returns a package."""
+        return self.stream().package()
+
+    def batches(self):
+        """Generate the data as lists of primitives. The balls are added as one pad
+        array per block of rows, with at most batch_size balls in each."""
+        data = []
+        params = self.params
+
+        mask = self.ball_mask()
+        if mask.sum() != params.pincount:
+            raise ValueError("Ball count %d does not match the name (%d)" % (
+                mask.sum(), params.pincount))
+
+        # Ball grid, centered on the origin
+        xs = (numpy.arange(params.cols) - (params.cols - 1) / 2.0) * params.pitch
+        ys = (numpy.arange(params.rows) - (params.rows - 1) / 2.0) * params.pitch
+        (gx, gy) = numpy.meshgrid(xs, ys)
+        landsize = params.balldiameter * params.landratio
+
+        bodyw = params.l1 / 2.0
+        bodyh = params.l2 / 2.0
+        outlinew = bodyw + params.silkwidth / 2.0
+        outlineh = bodyh + params.silkwidth / 2.0
+
+        # Draw courtyard on package layer
+        rect = Rectangle(*self.courtyard())
+        rect.layer = "package"
+        data.append(rect)
+
+        # Draw package size on package layer
+        rect = Rectangle( (-bodyw, -bodyh), (bodyw, bodyh))
+        rect.layer = "package"
+        data.append(rect)
+
+        # Draw outline on silkscreen, with a chamfered corner by ball A1
+        chamfer = min(1.0, bodyw / 4, bodyh / 4)
+        for (start, end) in [ ((-outlinew + chamfer, -outlineh), (outlinew, -outlineh)),
+                              ((outlinew, -outlineh), (outlinew, outlineh)),
+                              ((outlinew, outlineh), (-outlinew, outlineh)),
+                              ((-outlinew, outlineh), (-outlinew, -outlineh + chamfer)),
+                              ((-outlinew, -outlineh + chamfer), (-outlinew + chamfer, -outlineh)) ]:
+            line = Line(start, end)
+            line.width = params.silkwidth
+            data.append(line)
+        yield data
+
+        # Add the balls
+        names = self.ball_names()
+        rows = max(1, batch_size // params.cols)
+        for r in range(0, params.rows, rows):
+            m = mask[r:r + rows]
+            yield [ PadArray(gx[r:r + rows][m], gy[r:r + rows][m], names[r:r + rows][m],
+                             landsize, landsize, "circle") ]
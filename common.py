@@ -1,27 +1,175 @@
 import numpy
 import math
+import numbers
+import gzip
+import io
+
+gzip_magic = b"\x1f\x8b"
+zstd_magic = b"\x28\xb5\x2f\xfd"
 
 def rotate(p, angle):
     """Rotate vector, compensating for the Y axis being upside down"""
     th = math.radians(angle)
     return (math.cos(th)*p[0] + math.sin(th)*p[1], -(math.sin(th)*p[0] - math.cos(th)*p[1]))
 
+NM_PER_MM = 1000000
+NM_PER_DECIMIL = 2560 # Same factor as decimil() and modfile.decimil2mm()
+
+class Nm(int):
+    """Length in integer nanometres. Lengths of this type are converted and formatted
+    exactly by the writers, instead of going through floats in mm. Sums, differences
+    and multiples of Nm lengths are Nm again, rounded to whole nanometres."""
+    __slots__ = ()
+
+    def __add__(self, other):
+        return nm_result(int(self) + other)
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return nm_result(int(self) - other)
+
+    def __rsub__(self, other):
+        return nm_result(other - int(self))
+
+    def __neg__(self):
+        return Nm(-int(self))
+
+    def __abs__(self):
+        return Nm(abs(int(self)))
+
+    def __mul__(self, other):
+        return nm_result(int(self) * other)
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Nm):
+            return int(self) / float(other) # Ratio of two lengths
+        return nm_result(int(self) / float(other))
+    __div__ = __truediv__
+
+def nm_result(v):
+    """Return the result of arithmetic on an Nm length as Nm. Arrays are left as
+    they are."""
+    if isinstance(v, numpy.ndarray):
+        return v
+    if isinstance(v, numbers.Integral):
+        return Nm(v)
+    return Nm(int(round(v)))
+
+def to_nm(mm):
+    """Convert mm (a number or NumPy array) to integer nanometres"""
+    if isinstance(mm, numpy.ndarray):
+        return numpy.rint(mm * NM_PER_MM).astype(numpy.int64)
+    if isinstance(mm, Nm):
+        return mm
+    return Nm(int(round(mm * NM_PER_MM)))
+
+def to_mm(nm):
+    """Convert nanometres (a number or NumPy array) to mm"""
+    if isinstance(nm, Nm):
+        nm = int(nm) # Nm division would round the result to whole nanometres
+    return nm / float(NM_PER_MM)
+
+def fmt_mm(v, digits):
+    """Format a length in mm with a fixed number of decimals. Nm lengths are rounded
+    half away from zero using integer arithmetic only."""
+    if not isinstance(v, Nm):
+        return "%.*f" % (digits, v)
+    q = 10 ** (6 - digits)
+    r = (abs(v) + q // 2) // q
+    if digits == 0:
+        return "%s%d" % ("-" if v < 0 and r else "", r)
+    return "%s%d.%0*d" % ("-" if v < 0 and r else "", r // 10 ** digits, digits, r % 10 ** digits)
+
 def decimil(mm):
     """Convert mm to kicad's old 1/10 mil format"""
+    if isinstance(mm, Nm):
+        r = (abs(mm) + NM_PER_DECIMIL // 2) // NM_PER_DECIMIL
+        return -r if mm < 0 else r
     return int(round(mm / 0.00256))
     
+def open_library(filename, mode="r", compression=None, level=None):
+    """Open a library file for streaming reads or writes. When reading, gzip and zstd
+    compressed files are detected from their magic bytes. When writing, compression
+    is None, "gzip" or "zstd", and level is the compression level (default for the
+    compressor if None)."""
+    if mode == "r":
+        f = open(filename, "rb")
+        magic = f.read(4)
+        if magic.startswith(gzip_magic):
+            f.seek(0)
+            return text_stream(gzip.GzipFile(fileobj=f, mode="rb"), mode)
+        elif magic.startswith(zstd_magic):
+            import zstandard
+            f.seek(0)
+            return text_stream(zstandard.ZstdDecompressor().stream_reader(f), mode)
+        f.close()
+        return open(filename, "r")
+    elif mode == "w":
+        if compression is None:
+            return open(filename, "w")
+        elif compression == "gzip":
+            return text_stream(gzip.open(filename, "wb", 9 if level is None else level), mode)
+        elif compression == "zstd":
+            import zstandard
+            cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+            return text_stream(cctx.stream_writer(open(filename, "wb")), mode)
+        else:
+            raise ValueError("Unsupported compression %s" % compression)
+    else:
+        raise ValueError("Unsupported mode %s" % mode)
+
+def text_stream(f, mode):
+    """Wrap a decompressing or compressing binary stream to read or write str, like a
+    plain file opened in mode. Python 2 str is bytes already, and lines are read in
+    large blocks by LineReader. Python 3 decodes and encodes with io.TextIOWrapper."""
+    if str is bytes:
+        return LineReader(f) if mode == "r" else f
+    return io.TextIOWrapper(f)
+
+compression_suffix = { None: "", "gzip": ".gz", "zstd": ".zst" }
+
+class LineReader(object):
+    """Iterate over the lines of a binary stream, decompressing large blocks at a time.
+    Much faster than line-by-line reads from the decompressors."""
+    def __init__(self, f, blocksize = 1 << 20):
+        self.f = f
+        self.lines = self.read_lines(blocksize)
+
+    def read_lines(self, blocksize):
+        rest = b""
+        for block in iter(lambda: self.f.read(blocksize), b""):
+            lines = (rest + block).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if rest:
+            yield rest
+
+    def __iter__(self):
+        return self.lines
+
+    def read(self, size):
+        """Read decompressed data. Don't mix with iterating over lines."""
+        return self.f.read(size)
+
+    def close(self):
+        self.f.close()
+
 class PilContext:
     """Keep context for drawing with PIL, emulating Cairo to some extent"""
     def __init__(self, draw):
         self.draw = draw
         self.pos = (0, 0)
         self.matrixstack = []
+        self.arcs = []
         self.matrix = numpy.matrix([[1.0, 0, 0], [0, 1.0, 0], [0, 0, 1.0]])
+        self.offset = (0, 0) # Whole pixels subtracted after rounding, for drawing tiles
 
     def devicecoord(self, c):
         v = numpy.matrix([ [c[0]], [c[1]], [1] ])
         d = self.matrix * v
-        return (int(round(d.item(0))), int(round(d.item(1))))
+        return (int(round(d.item(0))) - self.offset[0], int(round(d.item(1))) - self.offset[1])
 
     def save(self):
         self.matrixstack.append(numpy.matrix(self.matrix))
@@ -65,52 +213,417 @@ class PilContext:
                           fill=self.color)
 
     def arc(self, x, y, size, start, end):
+        # Full circles only, drawn on the following stroke() or fill()
         s = size
-        self.draw.arc(self.devicecoord((x-s, y-s)) + self.devicecoord((x+s, y+s)),
-                      0, 360, fill=self.color)
+        self.arcs.append(self.devicecoord((x-s, y-s)) + self.devicecoord((x+s, y+s)))
 
     def stroke(self):
-        pass
+        for box in self.arcs:
+            self.draw.arc(box, 0, 360, fill=self.color)
+        self.arcs = []
 
     def fill(self):
-        pass
+        for box in self.arcs:
+            self.draw.ellipse(box, fill=self.color)
+        self.arcs = []
+
+
+def flip_side(layer):
+    """Return the name of the layer on the other side of the board (F.SilkS <-> B.SilkS)"""
+    if layer.startswith("F."):
+        return "B." + layer[2:]
+    elif layer.startswith("B."):
+        return "F." + layer[2:]
+    return layer
+
+# Layer numbers in kicad's old module format
+legacy_layers = { "F.SilkS": 21, "B.SilkS": 20 }
+# Layer masks for SMD pads (copper, paste and mask) on each side
+legacy_pad_layers = { "F": "00888000", "B": "00440001" }
+# Copper layer of the module itself on each side
+legacy_module_layers = { "F": 15, "B": 0 }
+
+class Transform(object):
+    """Affine transform of the plane. Transforms are composed without touching any
+    coordinates, and applied to many points at once with apply(). They are never
+    modified after creation, so one object can be shared by many primitives."""
+    __slots__ = ("m", "angle", "mirrored", "factor")
+
+    def __init__(self, m = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0), angle = 0, mirrored = False, factor = 1.0):
+        self.m = m               # (a, b, c, d, e, f): x' = a*x + b*y + c, y' = d*x + e*y + f
+        self.angle = angle       # [degrees] rotation added to pads
+        self.mirrored = mirrored # flipped to the other side of the board
+        self.factor = factor     # scale factor for sizes and line widths
+
+    def then(self, other):
+        """Return the transform that applies self first and other after that"""
+        if self.is_identity():
+            return other
+        (a, b, c, d, e, f) = self.m
+        (A, B, C, D, E, F) = other.m
+        return Transform((A*a + B*d, A*b + B*e, A*c + B*f + C,
+                          D*a + E*d, D*b + E*e, D*c + E*f + F),
+                         (-self.angle if other.mirrored else self.angle) + other.angle,
+                         self.mirrored != other.mirrored,
+                         self.factor * other.factor)
+
+    def is_identity(self):
+        return (self.m == (1.0, 0.0, 0.0, 0.0, 1.0, 0.0) and self.angle == 0 and
+                not self.mirrored and self.factor == 1.0)
+
+    def rotated(self, th):
+        """Rotate by th degrees, in the same direction as rotate()"""
+        t = math.radians(th)
+        return self.then(Transform((math.cos(t), math.sin(t), 0.0,
+                                    -math.sin(t), math.cos(t), 0.0), th))
+
+    def translated(self, dx, dy):
+        return self.then(Transform((1.0, 0.0, dx, 0.0, 1.0, dy)))
+
+    def mirrored_x(self):
+        """Mirror X coordinates and move everything to the other side of the board"""
+        return self.then(Transform((-1.0, 0.0, 0.0, 0.0, 1.0, 0.0), 0, True))
+
+    def scaled(self, s):
+        return self.then(Transform((s, 0.0, 0.0, 0.0, s, 0.0), 0, False, s))
+
+    def apply(self, xs, ys):
+        """Transform points given as X and Y sequences, returns X and Y arrays"""
+        (a, b, c, d, e, f) = self.m
+        xs = numpy.asarray(xs, dtype=float)
+        ys = numpy.asarray(ys, dtype=float)
+        # Same operation order as rotate(), so the results are bit-identical
+        rx = a*xs + b*ys
+        ry = -((-d)*xs - e*ys)
+        # Only add translations that are there, to keep the sign of zero results
+        if c:
+            rx += c
+        if f:
+            ry += f
+        return (rx, ry)
+
+    def layer(self, layer):
+        if self.mirrored:
+            return flip_side(layer)
+        return layer
+
+    def pad_rotation(self, rotation):
+        """Return the rotation of a pad after the transform, in [0, 360) degrees"""
+        if self.mirrored:
+            return (-rotation + self.angle) % 360
+        return (rotation + self.angle) % 360
+
+def compose(first, second):
+    """Compose two transforms where either may be None (identity)"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first.then(second)
+
+def transform_box(box, t):
+    """Return the bounding box of a transformed box ((x0, y0), (x1, y1))"""
+    if t is None:
+        return box
+    (xs, ys) = t.apply((box[0][0], box[1][0], box[1][0], box[0][0]),
+                       (box[0][1], box[0][1], box[1][1], box[1][1]))
+    return ( (float(xs.min()), float(ys.min())), (float(xs.max()), float(ys.max())) )
+
+class Package(object):
+    __slots__ = ("data", "bbox", "description", "courtyard", "transform", "units")
 
-    
-class Package:
     def __init__(self):
         self.data = []
         self.bbox = ( (0,0), (0,0) )
+        self.transform = None # Applied on top of the primitives' own transforms
+        self.units = "mm"     # "mm" for float mm, "nm" for integer nanometres (Nm)
+
+    def converted(self, units):
+        """Return the package with all lengths in units ("mm" or "nm"). Returns the
+        package itself if it is already in those units. Transforms are always in mm,
+        so they are applied before converting to nm and kept when converting to mm."""
+        if self.units == units:
+            return self
+        if units == "nm":
+            (f, source) = (to_nm, self.placed())
+        else:
+            (f, source) = (to_mm, self)
+        package = Package()
+        package.units = units
+        package.transform = source.transform
+        for d in source.data:
+            c = d.convert(f)
+            c.transform = d.transform
+            package.data.append(c)
+        package.bbox = tuple( (f(p[0]), f(p[1])) for p in source.bbox )
+        if hasattr(source, "description"):
+            package.description = source.description
+        if hasattr(source, "courtyard"):
+            package.courtyard = tuple( (f(p[0]), f(p[1])) for p in source.courtyard )
+        return package
+
+    def rotate(self, th):
+        self.transform = compose(self.transform, Transform().rotated(th))
+
+    def translate(self, dx, dy):
+        self.transform = compose(self.transform, Transform().translated(dx, dy))
+
+    def mirror(self):
+        """Flip the package to the back side of the board"""
+        self.transform = compose(self.transform, Transform().mirrored_x())
+
+    def scale(self, s):
+        self.transform = compose(self.transform, Transform().scaled(s))
+
+    def placed(self):
+        """Return a package where all transforms have been applied to the coordinates.
+        Primitives are grouped by transform and each group is transformed with one
+        NumPy operation. Returns the package itself if there is nothing to do."""
+        if self.units == "nm" and (self.transform is not None or
+                                   any(d.transform is not None for d in self.data)):
+            return self.converted("mm").placed().converted("nm")
+        groups = {}
+        order = []
+        for (i, d) in enumerate(self.data):
+            if d.transform is None and self.transform is None:
+                continue
+            key = id(d.transform)
+            if key not in groups:
+                groups[key] = (compose(d.transform, self.transform), [])
+                order.append(key)
+            groups[key][1].append(i)
+        if not order:
+            return self
+
+        data = list(self.data)
+        for key in order:
+            (t, indices) = groups[key]
+            xs = []
+            ys = []
+            for i in indices:
+                (x, y) = data[i].coords()
+                xs.extend(x)
+                ys.extend(y)
+            (xs, ys) = t.apply(xs, ys)
+            xs = xs.tolist()
+            ys = ys.tolist()
+            pos = 0
+            for i in indices:
+                n = data[i].ncoords()
+                data[i] = data[i].placed(xs[pos:pos + n], ys[pos:pos + n], t)
+                pos += n
+
+        package = Package()
+        package.data = data
+        package.bbox = transform_box(self.bbox, self.transform)
+        if hasattr(self, "description"):
+            package.description = self.description
+        if hasattr(self, "courtyard"):
+            package.courtyard = transform_box(self.courtyard, self.transform)
+        return package
+
+    def batches(self):
+        """Iterate over the placed primitives in lists. A package has all of them in
+        one list, see PackageStream for packages that are generated batch by batch."""
+        yield self.placed().data
+
+    def side(self):
+        """Return "B" for packages on the back side of the board, otherwise "F".
+        Placed packages have no transform left and go by the layers of their pads."""
+        if self.transform is not None:
+            return "B" if self.transform.mirrored else "F"
+        layers = set(d.layer[0] for d in self.data if isinstance(d, (Pad, PadArray)))
+        return "B" if layers == set("B") else "F"
+
+    def pad_table(self):
+        """Return (numbers, layers, table) for all pads of the placed package in mm.
+        numbers and layers are lists of strings and table has one (x, y, xsize, ysize,
+        rotation) row per pad."""
+        numbers = []
+        layers = []
+        rows = []
+        for data in self.converted("mm").batches():
+            for d in data:
+                if isinstance(d, Pad):
+                    numbers.append(str(d.number))
+                    layers.append(d.layer)
+                    rows.append((d.x, d.y, d.xsize, d.ysize, d.rotation))
+                elif isinstance(d, PadArray):
+                    a = numpy.empty((len(d), 5))
+                    a[:, 0] = d.x
+                    a[:, 1] = d.y
+                    a[:, 2:] = (d.xsize, d.ysize, d.rotation)
+                    numbers.extend(d.names.tolist())
+                    layers.extend([ d.layer ] * len(d))
+                    rows.extend(a.tolist())
+        return (numbers, layers, numpy.array(rows, dtype=float).reshape(-1, 5))
+
+    def line_table(self):
+        """Return (layers, table) for the lines and rectangles of the placed package in
+        mm, leaving out the package layer. layers is a list of strings and table has
+        one (x0, y0, x1, y1, width) row per line."""
+        layers = []
+        rows = []
+        for data in self.converted("mm").batches():
+            for d in data:
+                if isinstance(d, Rectangle):
+                    lines = d.lines
+                elif isinstance(d, Line):
+                    lines = (d,)
+                else:
+                    continue
+                for l in lines:
+                    if l.layer != "package":
+                        layers.append(l.layer)
+                        rows.append((l.start[0], l.start[1], l.end[0], l.end[1], l.width))
+        return (layers, numpy.array(rows, dtype=float).reshape(-1, 5))
 
     def expand_bbox(self, p):
         self.bbox = ( (min(self.bbox[0][0], p[0]), min(self.bbox[0][1], p[1])),
                       (max(self.bbox[1][0], p[0]), max(self.bbox[1][1], p[1])) )
 
-class Line:
+    def expand_bbox_bulk(self, xs, ys):
+        """Expand bbox to cover all points given as separate X and Y sequences"""
+        if len(xs) == 0:
+            return
+        xs = numpy.asarray(xs)
+        ys = numpy.asarray(ys)
+        self.bbox = ( (min(self.bbox[0][0], xs.min().item()), min(self.bbox[0][1], ys.min().item())),
+                      (max(self.bbox[1][0], xs.max().item()), max(self.bbox[1][1], ys.max().item())) )
+
+# Largest number of pads that generators put in one batch of a PackageStream
+batch_size = 256
+
+class PackageStream(Package):
+    """Package whose primitives are generated batch by batch when it is read, rather
+    than held in the data list. Writers that loop over batches() only ever have one
+    batch in memory, and the bbox is expanded to cover each batch as it is placed.
+    placed() and package() generate all of it into an ordinary Package."""
+    __slots__ = ("source",)
+
+    def __init__(self, source):
+        Package.__init__(self)
+        self.source = source # Function returning an iterator over lists of primitives
+
+    def package(self):
+        """Return an ordinary Package with all batches in its data list"""
+        package = Package()
+        package.units = self.units
+        package.transform = self.transform
+        for data in self.source():
+            package.data.extend(data)
+        if hasattr(self, "description"):
+            package.description = self.description
+        if hasattr(self, "courtyard"):
+            package.courtyard = self.courtyard
+        return package
+
+    def placed(self):
+        return self.package().placed()
+
+    def converted(self, units):
+        """Return a stream that converts each batch to units. Converting to nm places
+        the primitives first, like Package.converted()."""
+        if self.units == units:
+            return self
+        if units == "nm":
+            (f, source, t) = (to_nm, self.batches, None)
+        else:
+            (f, source, t) = (to_mm, self.source, self.transform)
+        def convert():
+            for data in source():
+                batch = []
+                for d in data:
+                    c = d.convert(f)
+                    c.transform = d.transform
+                    batch.append(c)
+                yield batch
+        stream = PackageStream(convert)
+        stream.units = units
+        stream.transform = t
+        if hasattr(self, "description"):
+            stream.description = self.description
+        if hasattr(self, "courtyard"):
+            box = transform_box(self.courtyard, self.transform) if t is None else self.courtyard
+            stream.courtyard = tuple( (f(p[0]), f(p[1])) for p in box )
+        return stream
+
+    def batches(self):
+        for data in self.source():
+            batch = Package()
+            batch.units = self.units
+            batch.transform = self.transform
+            batch.data = data
+            data = batch.placed().data
+            extents = [ d.extent() for d in data ]
+            self.expand_bbox_bulk([ e[i][0] for e in extents for i in (0, 1) ],
+                                  [ e[i][1] for e in extents for i in (0, 1) ])
+            yield data
+
+
+class Line(object):
+    __slots__ = ("layer", "width", "start", "end", "transform")
+
     def __init__(self, start, end, width = 0):
         self.layer = "F.SilkS"
         self.width = width
         self.start = start
         self.end = end
+        self.transform = None # Applied by Package.placed()
 
     def rotate(self, th):
         self.start = rotate(self.start, th)
         self.end = rotate(self.end, th)
 
+    def ncoords(self):
+        return 2
+
+    def coords(self):
+        return ( (self.start[0], self.end[0]), (self.start[1], self.end[1]) )
+
+    def placed(self, xs, ys, t):
+        l = Line( (xs[0], ys[0]), (xs[1], ys[1]), self.width * t.factor )
+        l.layer = t.layer(self.layer)
+        return l
+
+    def convert(self, f):
+        """Return a copy with all lengths converted by f, like to_nm or to_mm"""
+        l = Line( (f(self.start[0]), f(self.start[1])), (f(self.end[0]), f(self.end[1])), f(self.width) )
+        l.layer = self.layer
+        return l
+
+    def extent(self):
+        """Return the bounding box ((x0, y0), (x1, y1)) covered when drawing"""
+        w = self.width / 2.0
+        return ( (min(self.start[0], self.end[0]) - w, min(self.start[1], self.end[1]) - w),
+                 (max(self.start[0], self.end[0]) + w, max(self.start[1], self.end[1]) + w) )
+
     def kicad_sexp(self):
         if self.layer == "package":
             return ""
-        return "  (fp_line (start %.3f %.3f) (end %.3f %.3f) (layer %s) (width %.2f))\n" % (
-            self.start[0], self.start[1],
-            self.end[0], self.end[1],
-            self.layer, self.width)
+        return "  (fp_line (start %s %s) (end %s %s) (layer %s) (width %s))\n" % (
+            fmt_mm(self.start[0], 3), fmt_mm(self.start[1], 3),
+            fmt_mm(self.end[0], 3), fmt_mm(self.end[1], 3),
+            self.layer, fmt_mm(self.width, 2))
 
     def kicad_mod(self):
         if self.layer == "package":
             return ""
-        return "DS %d %d %d %d %d 21\n" % (
+        return "DS %d %d %d %d %d %d\n" % (
             decimil(self.start[0]), decimil(self.start[1]),
             decimil(self.end[0]), decimil(self.end[1]),
-            decimil(self.width))
+            decimil(self.width), legacy_layers.get(self.layer, 21))
+
+    def style(self):
+        """Return (operation, color, line width) for batched drawing with path()"""
+        if self.layer == "package":
+            return ("stroke", (0, 0, 0), self.width)
+        else:
+            return ("stroke", (0, 0.52, 0.52), self.width)
+
+    def path(self, ctx):
+        ctx.move_to(*self.start)
+        ctx.line_to(*self.end)
 
     def draw(self, ctx):
         if self.layer == "package":
@@ -123,56 +636,128 @@ class Line:
         ctx.stroke()
 
 
-class Rectangle:
+class Rectangle(object):
+    """Four lines between the corners of a rectangle. Only the corners are stored,
+    the lines are made on demand."""
+    __slots__ = ("layer", "width", "corners", "transform")
+
     def __init__(self, start, end, width = 0):
         self.layer = "F.SilkS"
         self.width = width
-        self.lines = [ Line((start[0], start[1]), (end[0], start[1])),
-                       Line((end[0], start[1]), (end[0], end[1])),
-                       Line((end[0], end[1]), (start[0], end[1])),
-                       Line((start[0], end[1]), (start[0], start[1])) ]
+        self.corners = ( (start[0], start[1]), (end[0], start[1]),
+                         (end[0], end[1]), (start[0], end[1]) )
+        self.transform = None # Applied by Package.placed()
+
+    @property
+    def lines(self):
+        c = self.corners
+        r = []
+        for i in range(0, 4):
+            l = Line(c[i], c[(i + 1) % 4], self.width)
+            l.layer = self.layer
+            r.append(l)
+        return r
 
     def rotate(self, th):
-        for l in self.lines: l.rotate(th)
+        self.corners = tuple(rotate(c, th) for c in self.corners)
 
-    def kicad_sexp(self):
-        r = ""
-        for l in self.lines:
-            l.layer = self.layer
-            l.width = self.width
-            r += l.kicad_sexp()
+    def ncoords(self):
+        return 4
+
+    def coords(self):
+        return ( [c[0] for c in self.corners], [c[1] for c in self.corners] )
+
+    def placed(self, xs, ys, t):
+        r = Rectangle( (0, 0), (0, 0), self.width * t.factor )
+        r.layer = t.layer(self.layer)
+        r.corners = tuple(zip(xs, ys))
         return r
 
-    def kicad_mod(self):
-        r = ""
-        for l in self.lines:
-            l.layer = self.layer
-            l.width = self.width
-            r += l.kicad_mod()
+    def convert(self, f):
+        r = Rectangle( (0, 0), (0, 0), f(self.width) )
+        r.layer = self.layer
+        r.corners = tuple( (f(c[0]), f(c[1])) for c in self.corners )
         return r
 
+    def extent(self):
+        w = self.width / 2.0
+        xs = [c[0] for c in self.corners]
+        ys = [c[1] for c in self.corners]
+        return ( (min(xs) - w, min(ys) - w), (max(xs) + w, max(ys) + w) )
+
+    def kicad_sexp(self):
+        return "".join(l.kicad_sexp() for l in self.lines)
+
+    def kicad_mod(self):
+        return "".join(l.kicad_mod() for l in self.lines)
+
+    def style(self):
+        if self.layer == "package":
+            return ("stroke", (0, 0, 0), self.width)
+        else:
+            return ("stroke", (0, 0.52, 0.52), self.width)
+
+    def path(self, ctx):
+        # Separate segments rather than a closed path, so corners get the same
+        # line caps as when the lines are drawn one by one
+        c = self.corners
+        for i in range(0, 4):
+            ctx.move_to(*c[i])
+            ctx.line_to(*c[(i + 1) % 4])
+
     def draw(self, ctx):
         for l in self.lines:
-            l.layer = self.layer
-            l.width = self.width
             l.draw(ctx)
 
 
-class Circle:
-    def __init__(self, pos, size):
+class Circle(object):
+    __slots__ = ("layer", "pos", "size", "width", "transform")
+
+    def __init__(self, pos, size, width = 0):
         self.layer = "F.SilkS"
         self.pos = pos
         self.size = size
+        self.width = width
+        self.transform = None # Applied by Package.placed()
+
+    def ncoords(self):
+        return 1
+
+    def coords(self):
+        return ( (self.pos[0],), (self.pos[1],) )
+
+    def placed(self, xs, ys, t):
+        c = Circle( (xs[0], ys[0]), self.size * t.factor )
+        c.layer = t.layer(self.layer)
+        c.width = self.width * t.factor
+        return c
+
+    def convert(self, f):
+        c = Circle( (f(self.pos[0]), f(self.pos[1])), f(self.size) )
+        c.layer = self.layer
+        c.width = f(self.width)
+        return c
+
+    def extent(self):
+        s = self.size + self.width / 2.0
+        return ( (self.pos[0] - s, self.pos[1] - s), (self.pos[0] + s, self.pos[1] + s) )
 
     def kicad_sexp(self):
-        return "  (fp_circle (center %.2f %.2f) (end %.2f %.2f) (layer %s) (width %.2f))\n" % (
-            self.pos[0], self.pos[1],
-            self.pos[0] + self.size, self.pos[1],
-            self.layer, self.width)
+        return "  (fp_circle (center %s %s) (end %s %s) (layer %s) (width %s))\n" % (
+            fmt_mm(self.pos[0], 2), fmt_mm(self.pos[1], 2),
+            fmt_mm(self.pos[0] + self.size, 2), fmt_mm(self.pos[1], 2),
+            self.layer, fmt_mm(self.width, 2))
 
     def kicad_mod(self, scale):
         return "\n"
 
+    def style(self):
+        return ("stroke", (0, 0.52, 0.52), self.width)
+
+    def path(self, ctx):
+        ctx.new_sub_path()
+        ctx.arc(self.pos[0], self.pos[1], self.size, 0, 2*math.pi)
+
     def draw(self, ctx):
         ctx.set_source_rgb(0, 0.52, 0.52)
         ctx.set_line_width(self.width)
@@ -180,32 +765,90 @@ class Circle:
         ctx.stroke()
 
 
-class Pad:
+class Pad(object):
+    __slots__ = ("number", "rotation", "x", "y", "xsize", "ysize", "layer", "transform")
+
     def __init__(self, number = None):
         self.number = number
         self.rotation = 0
+        self.layer = "F.Cu" # Copper layer, paste and mask go on the same side
+        self.transform = None # Applied by Package.placed()
 
     def rotate(self, th):
         self.rotation += th
         (self.x, self.y) = rotate((self.x, self.y), th)
 
+    def ncoords(self):
+        return 1
+
+    def coords(self):
+        return ( (self.x,), (self.y,) )
+
+    def placed(self, xs, ys, t):
+        pad = Pad(self.number)
+        pad.x = xs[0]
+        pad.y = ys[0]
+        pad.xsize = self.xsize * t.factor
+        pad.ysize = self.ysize * t.factor
+        pad.rotation = t.pad_rotation(self.rotation)
+        pad.layer = t.layer(self.layer)
+        return pad
+
+    def convert(self, f):
+        pad = Pad(self.number)
+        pad.x = f(self.x)
+        pad.y = f(self.y)
+        pad.xsize = f(self.xsize)
+        pad.ysize = f(self.ysize)
+        pad.rotation = self.rotation
+        pad.layer = self.layer
+        return pad
+
+    def extent(self):
+        # Half the diagonal covers the pad at any rotation
+        s = math.hypot(self.xsize, self.ysize) / 2.0
+        return ( (self.x - s, self.y - s), (self.x + s, self.y + s) )
+
     def kicad_sexp(self):
-        return "  (pad %d smd rect (at %.2f %.2f %.0f) (size %.2f %.2f) (layers F.Cu F.Paste F.Mask))\n" % (
+        side = self.layer[0]
+        return "  (pad %s smd rect (at %s %s %.0f) (size %s %s) (layers %s.Cu %s.Paste %s.Mask))\n" % (
             self.number,
-            self.x, self.y,
+            fmt_mm(self.x, 2), fmt_mm(self.y, 2),
             self.rotation,
-            self.xsize,
-            self.ysize)
+            fmt_mm(self.xsize, 2),
+            fmt_mm(self.ysize, 2),
+            side, side, side)
 
     def kicad_mod(self):
         return """$PAD
-Sh "%d" R %d %d 0 0 %d
+Sh "%s" R %d %d 0 0 %d
 Dr 0 0 0
-At SMD N 00888000
+At SMD N %s
 Ne 0 ""
 Po %d %d
 $EndPAD
-""" % (self.number, decimil(self.xsize), decimil(self.ysize), self.rotation * 10, decimil(self.x), decimil(self.y))
+""" % (self.number, decimil(self.xsize), decimil(self.ysize), self.rotation * 10,
+       legacy_pad_layers[self.layer[0]], decimil(self.x), decimil(self.y))
+
+    def polygon(self):
+        """Return the pad corners in drawing coordinates, rotated like draw() does"""
+        th = math.radians(self.rotation)
+        c = math.cos(th)
+        s = math.sin(th)
+        dx = self.xsize / 2.0
+        dy = self.ysize / 2.0
+        return [ (self.x + px*c - py*s, self.y + px*s + py*c)
+                 for (px, py) in ((-dx, -dy), (dx, -dy), (dx, dy), (-dx, dy)) ]
+
+    def style(self):
+        return ("fill", (0.52, 0, 0), None)
+
+    def path(self, ctx):
+        c = self.polygon()
+        ctx.move_to(*c[0])
+        for p in c[1:]:
+            ctx.line_to(*p)
+        ctx.close_path()
 
     def draw(self, ctx):
         ctx.save()
@@ -215,3 +858,136 @@ $EndPAD
         ctx.rectangle(-self.xsize/2, -self.ysize/2, self.xsize, self.ysize)
         ctx.fill()
         ctx.restore()
+
+
+class PadArray(object):
+    """Many pads of the same shape, with positions and names held in NumPy arrays.
+    Used for packages with so many pads that one Pad object per pad gets slow."""
+    __slots__ = ("x", "y", "names", "xsize", "ysize", "shape", "rotation", "layer", "transform")
+
+    def __init__(self, x, y, names, xsize, ysize, shape = "rect"):
+        # Positions are float arrays in mm, or int64 arrays in nm when the sizes are Nm
+        dtype = numpy.int64 if isinstance(xsize, Nm) else float
+        self.x = numpy.asarray(x, dtype=dtype)
+        self.y = numpy.asarray(y, dtype=dtype)
+        self.names = numpy.asarray(names, dtype=str)
+        self.xsize = xsize
+        self.ysize = ysize
+        self.shape = shape # "rect" or "circle"
+        self.rotation = 0
+        self.layer = "F.Cu"
+        self.transform = None # Applied by Package.placed()
+
+    def __len__(self):
+        return len(self.x)
+
+    def pads(self):
+        """Return the pads as a list of Pad objects"""
+        r = []
+        for (name, x, y) in zip(self.names, self.xlist(), self.ylist()):
+            pad = Pad(name)
+            pad.x = x
+            pad.y = y
+            pad.xsize = self.xsize
+            pad.ysize = self.ysize
+            pad.rotation = self.rotation
+            pad.layer = self.layer
+            r.append(pad)
+        return r
+
+    def ncoords(self):
+        return len(self.x)
+
+    def coords(self):
+        return (self.x, self.y)
+
+    def placed(self, xs, ys, t):
+        a = PadArray(xs, ys, self.names, self.xsize * t.factor, self.ysize * t.factor, self.shape)
+        a.rotation = t.pad_rotation(self.rotation)
+        a.layer = t.layer(self.layer)
+        return a
+
+    def convert(self, f):
+        a = PadArray(f(self.x), f(self.y), self.names, f(self.xsize), f(self.ysize), self.shape)
+        a.rotation = self.rotation
+        a.layer = self.layer
+        return a
+
+    def xlist(self):
+        """Return the X positions as a list of numbers, Nm if the array is in nm"""
+        if isinstance(self.xsize, Nm):
+            return [ Nm(v) for v in self.x.tolist() ]
+        return self.x.tolist()
+
+    def ylist(self):
+        if isinstance(self.xsize, Nm):
+            return [ Nm(v) for v in self.y.tolist() ]
+        return self.y.tolist()
+
+    def rotate(self, th):
+        self.rotation += th
+        t = math.radians(th)
+        (self.x, self.y) = (math.cos(t)*self.x + math.sin(t)*self.y,
+                            -(math.sin(t)*self.x - math.cos(t)*self.y))
+
+    def extent(self):
+        if len(self.x) == 0:
+            return ( (0, 0), (0, 0) )
+        s = math.hypot(self.xsize, self.ysize) / 2.0
+        return ( (float(self.x.min()) - s, float(self.y.min()) - s),
+                 (float(self.x.max()) + s, float(self.y.max()) + s) )
+
+    def kicad_sexp(self):
+        side = self.layer[0]
+        fmt = "  (pad %%s smd %s (at %%s %%s %.0f) (size %s %s) (layers %s.Cu %s.Paste %s.Mask))\n" % (
+            self.shape, self.rotation, fmt_mm(self.xsize, 2), fmt_mm(self.ysize, 2), side, side, side)
+        if isinstance(self.xsize, Nm):
+            x = [ fmt_mm(v, 2) for v in self.xlist() ]
+            y = [ fmt_mm(v, 2) for v in self.ylist() ]
+        else:
+            x = [ "%.2f" % v for v in self.x.tolist() ]
+            y = [ "%.2f" % v for v in self.y.tolist() ]
+        return "".join(fmt % t for t in zip(self.names, x, y))
+
+    def kicad_mod(self):
+        fmt = """$PAD
+Sh "%%s" %s %d %d 0 0 %d
+Dr 0 0 0
+At SMD N %s
+Ne 0 ""
+Po %%d %%d
+$EndPAD
+""" % ("C" if self.shape == "circle" else "R",
+       decimil(self.xsize), decimil(self.ysize), self.rotation * 10,
+       legacy_pad_layers[self.layer[0]])
+        if isinstance(self.xsize, Nm):
+            # Integer division rounding half away from zero, like decimil()
+            h = NM_PER_DECIMIL // 2
+            x = (numpy.sign(self.x) * ((numpy.abs(self.x) + h) // NM_PER_DECIMIL)).tolist()
+            y = (numpy.sign(self.y) * ((numpy.abs(self.y) + h) // NM_PER_DECIMIL)).tolist()
+        else:
+            x = numpy.rint(self.x / 0.00256).astype(int).tolist()
+            y = numpy.rint(self.y / 0.00256).astype(int).tolist()
+        return "".join(fmt % t for t in zip(self.names, x, y))
+
+    def style(self):
+        return ("fill", (0.52, 0, 0), None)
+
+    def path(self, ctx):
+        if self.shape == "circle":
+            for (x, y) in zip(self.xlist(), self.ylist()):
+                ctx.new_sub_path()
+                ctx.arc(x, y, self.xsize / 2.0, 0, 2*math.pi)
+        else:
+            for pad in self.pads():
+                pad.path(ctx)
+
+    def draw(self, ctx):
+        if self.shape == "circle":
+            ctx.set_source_rgb(0.52, 0, 0)
+            for (x, y) in zip(self.xlist(), self.ylist()):
+                ctx.arc(x, y, self.xsize / 2.0, 0, 2*math.pi)
+            ctx.fill()
+        else:
+            for pad in self.pads():
+                pad.draw(ctx)
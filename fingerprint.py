@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# Find footprints with the same land pattern under different names.
+#
+# The fingerprint of a module is its set of pads (position, size and rotation), moved
+# so that the pad centroid is at the origin and turned to whichever multiple of 90
+# degrees sorts first. Modules with the same fingerprint hash are exact duplicates.
+#
+# Near duplicates, where each pad is within a tolerance, are found by bucketing the
+# fingerprints on pad count and quantized pad span, and only comparing fingerprints
+# in neighbouring buckets. Pad names, shapes and layers are not compared.
+#
+# Example:
+#   ./fingerprint.py --tolerance 0.02 standard-qfp-N.mod vendor.mod.gz
+#
+
+import optparse
+import os
+import hashlib
+import numpy
+import modfile
+
+def quarter_turns(pads):
+    """Return the pad table centered on the pad centroid and turned by 0, 90, 180 and
+    270 degrees. Rows are (x, y, xsize, ysize, residual rotation), with the pad turned
+    to within 45 degrees of the axes."""
+    x = pads[:, 0] - pads[:, 0].mean()
+    y = pads[:, 1] - pads[:, 1].mean()
+    turns = []
+    for k in range(0, 4):
+        rotation = pads[:, 4] + 90 * k
+        q = numpy.round(rotation / 90.0)
+        swap = q % 2 == 1
+        t = numpy.empty_like(pads)
+        t[:, 0] = x
+        t[:, 1] = y
+        t[:, 2] = numpy.where(swap, pads[:, 3], pads[:, 2])
+        t[:, 3] = numpy.where(swap, pads[:, 2], pads[:, 3])
+        t[:, 4] = rotation - 90 * q
+        turns.append(t)
+        # Same direction as common.rotate(): (x, y) -> (y, -x)
+        (x, y) = (y, -x)
+    return turns
+
+def quantize(pads, resolution):
+    """Return the pads as sorted integer rows on a grid of resolution mm"""
+    q = numpy.round(pads[:, :4] / resolution).astype(numpy.int64)
+    r = numpy.round(pads[:, 4:] / 0.01).astype(numpy.int64) # Rotation to 0.01 degrees
+    q = numpy.hstack((q, r))
+    return q[numpy.lexsort(q.T[::-1])]
+
+def fingerprint(pads, resolution=0.001):
+    """Return (hash, canonical pad table) of a pad table"""
+    best = None
+    for t in quarter_turns(pads):
+        key = quantize(t, resolution).tobytes()
+        if best is None or key < best[0]:
+            best = (key, t)
+    return (hashlib.sha1(best[0]).hexdigest(), best[1])
+
+def max_deviation(a, b, tolerance, chunk=256):
+    """Return the largest distance, in any pad coordinate or size, from a pad in one
+    table to the nearest pad in the other. Both tables are centered, and b is tried at
+    each quarter turn. Returns None as soon as it is clear the tables don't match."""
+    if len(a) != len(b):
+        return None
+    best = None
+    for t in quarter_turns(b):
+        worst = 0.0
+        bmin = numpy.full(len(t), numpy.inf)
+        for i in range(0, len(a), chunk):
+            d = numpy.abs(a[i:i + chunk, numpy.newaxis, :4] - t[numpy.newaxis, :, :4]).max(axis=2)
+            amin = d.min(axis=1)
+            worst = max(worst, float(amin.max()))
+            if worst > tolerance:
+                break
+            bmin = numpy.minimum(bmin, d.min(axis=0))
+        else:
+            worst = max(worst, float(bmin.max()))
+            if worst <= tolerance and (best is None or worst < best):
+                best = worst
+    return best
+
+class FingerprintIndex(object):
+    def __init__(self, resolution=0.001, tolerance=0.01):
+        self.resolution = resolution # [mm] grid for exact matches
+        self.tolerance = tolerance   # [mm] largest pad difference for near matches
+        self.names = {}   # Module names by fingerprint hash
+        self.shapes = {}  # Canonical pad table by fingerprint hash
+        self.buckets = {} # Fingerprint hashes by (pad count, quantized pad span)
+
+    def add(self, name, package):
+        """Add a module, returns its fingerprint hash or None if it has no pads"""
+        pads = package.pad_table()[2]
+        if len(pads) == 0:
+            return None
+        (key, shape) = fingerprint(pads, self.resolution)
+        if key not in self.names:
+            self.names[key] = []
+            self.shapes[key] = shape
+            self.buckets.setdefault(self.bucket(shape), []).append(key)
+        self.names[key].append(name)
+        return key
+
+    def add_library(self, filename):
+        """Add all modules of a .mod library, named library:module"""
+        mod = modfile.Mod(filename)
+        mod.parse()
+        library = os.path.split(filename)[1]
+        for (name, package) in zip(mod.names, mod.mods):
+            self.add("%s:%s" % (library, name), package)
+
+    def bucket(self, shape):
+        # Pad centers move by at most 2*tolerance relative to each other, so the span
+        # of a near match is at most one cell away in each direction
+        cell = max(2 * self.tolerance, self.resolution)
+        w = numpy.ptp(shape[:, 0])
+        h = numpy.ptp(shape[:, 1])
+        return (len(shape), int(max(w, h) // cell), int(min(w, h) // cell))
+
+    def duplicates(self):
+        """Return lists of names of modules with the same fingerprint"""
+        return [ names for names in self.names.values() if len(names) > 1 ]
+
+    def near_duplicates(self):
+        """Return clusters of fingerprints that match within the tolerance, as lists of
+        (largest deviation from the first fingerprint, names) tuples. Fingerprints
+        are only compared to fingerprints in the same or a neighbouring bucket."""
+        parent = {}
+        def find(k):
+            while parent.get(k, k) != k:
+                k = parent[k]
+            return k
+
+        for ((n, a, b), keys) in self.buckets.items():
+            neighbours = []
+            for da in (-1, 0, 1):
+                for db in (-1, 0, 1):
+                    neighbours.extend(self.buckets.get((n, a + da, b + db), ()))
+            for k1 in keys:
+                for k2 in neighbours:
+                    if k2 <= k1 or find(k1) == find(k2):
+                        continue
+                    if max_deviation(self.shapes[k1], self.shapes[k2], self.tolerance) is not None:
+                        parent[find(k2)] = find(k1)
+
+        clusters = {}
+        for k in parent:
+            clusters.setdefault(find(k), []).append(k)
+        result = []
+        for (root, keys) in clusters.items():
+            keys = [ root ] + sorted(k for k in keys if k != root)
+            result.append([ (0.0 if k == root else
+                             max_deviation(self.shapes[root], self.shapes[k], numpy.inf),
+                             self.names[k]) for k in keys ])
+        return result
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="Usage: %prog [options] library.mod ...",
+                                   description="Find modules with the same land pattern")
+    parser.add_option("--resolution", dest="resolution", type="float", default=0.001,
+                      help="Grid for exact matches [mm]", metavar="N")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=0.01,
+                      help="Largest pad position or size difference of near matches [mm]",
+                      metavar="N")
+    parser.add_option("--exact", dest="exact", action="store_true", default=False,
+                      help="Only report exact duplicates")
+    (options, args) = parser.parse_args()
+
+    if not args:
+        parser.error("No libraries given")
+
+    index = FingerprintIndex(options.resolution, options.tolerance)
+    for filename in args:
+        index.add_library(filename)
+
+    duplicates = sorted(index.duplicates())
+    for names in duplicates:
+        print("Exact: %s" % " ".join(names))
+    print("%d fingerprints, %d exact duplicate groups" % (len(index.names), len(duplicates)))
+
+    if not options.exact:
+        clusters = index.near_duplicates()
+        for cluster in clusters:
+            print("Near:")
+            for (deviation, names) in cluster:
+                print("  %.4f %s" % (deviation, " ".join(names)))
+        print("%d near duplicate clusters" % len(clusters))
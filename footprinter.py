@@ -31,10 +31,18 @@
 import optparse
 import qfp
 import soic
+import bga
 import time
 import sys
 import common
 import re
+import os
+import math
+import struct
+import zlib
+import numpy
+import threading
+import multiprocessing
 
 description="""Generate a QFP footprint (land pattern) from an IPC name.
 The name is given on the form QFP<pitch>P<L1>X<L2>[X<height>]-<pincount>, where
@@ -47,22 +55,42 @@ the distance between the pin ends is 9.00 mm, pin pitch 0.50 mm (this is a stand
 7x7 mm LQFP package).
 """
 
+def make_generator(name):
+    """Return a generator for the package family of an IPC name, or None if unknown"""
+    generator = None
+    if re.match("^QFP", name):
+        generator = qfp.Qfp()
+    if re.match("^SOIC", name):
+        generator = soic.Soic()
+    if re.match("^SOP", name):
+        generator = soic.Soic()
+    if re.match("^BGA", name):
+        generator = bga.Bga()
+    return generator
+
 def make_kicad_mod(f, name, package):
-    f.write("(module %s (layer F.Cu) (tedit %X)\n" % (name, time.time()))
+    side = package.side()
+    # Texts of back side modules are on the back silkscreen, mirrored
+    mirror = " (justify mirror)" if side == "B" else ""
+    f.write("(module %s (layer %s.Cu) (tedit %X)\n" % (name, side, int(time.time())))
     f.write("  (at 0 0)\n")
     f.write("  (descr \"%s\")\n" % package.description)
     f.write("  (tags qfp, lqfp, tqfp)\n")
     f.write("  (model smd/tqfp32.wrl (at (xyz 0 0 0)) (scale (xyz 1 1 1)) (rotate (xyz 0 0 0)))\n")
-    f.write("  (fp_text reference %s (at 0 -1) (layer F.SilkS)\n" % name)
-    f.write("    (effects (font (size 1.5 1.5) (thickness 0.15))))\n")
-    f.write("  (fp_text value VAL** (at 0 1) (layer F.SilkS) hide\n")
-    f.write("    (effects (font (size 1.5 1.5) (thickness 0.15))))\n")
-    for d in package.data:
-        f.write(d.kicad_sexp())
+    f.write("  (fp_text reference %s (at 0 -1) (layer %s.SilkS)\n" % (name, side))
+    f.write("    (effects (font (size 1.5 1.5) (thickness 0.15))%s))\n" % mirror)
+    f.write("  (fp_text value VAL** (at 0 1) (layer %s.SilkS) hide\n" % side)
+    f.write("    (effects (font (size 1.5 1.5) (thickness 0.15))%s))\n" % mirror)
+    for data in package.batches():
+        for d in data:
+            f.write(d.kicad_sexp())
     f.write(")\n") # close module
 
 def make_emp(f, name, package, write_lib_header=True):
     m = common.decimil
+    side = package.side()
+    silk = common.legacy_layers[side + ".SilkS"]
+    mirror = "M" if side == "B" else "N"
     if write_lib_header:
         f.write("PCBNEW-LibModule-V1  %s\n" % time.asctime())
         f.write("$INDEX\n")
@@ -70,32 +98,62 @@ def make_emp(f, name, package, write_lib_header=True):
         f.write("$EndINDEX\n")
 
     f.write("$MODULE %s\n" % name)
-    f.write("Po 0 0 0 15 %X 00000000 ~~\n" % time.time())
+    f.write("Po 0 0 0 %d %X 00000000 ~~\n" % (common.legacy_module_layers[side], int(time.time())))
     f.write("Li %s\n" % name)
     f.write("Cd %s\n" % package.description)
     f.write("Sc 0\n")
     f.write("AR \n")
     f.write("Op 0 0 0\n")
 
-    f.write("T0 %d %d %d %d %d %d N V 21 N \"%s\"\n" % (m(0), m(-1), m(1.5), m(1.5), m(0), m(0.15), name))
-    f.write("T1 %d %d %d %d %d %d N I 21 N \"%s\"\n" % (m(0), m(1), m(1.5), m(1.5), m(0), m(0.15), "VAL**"))
+    f.write("T0 %d %d %d %d %d %d %s V %d N \"%s\"\n" % (m(0), m(-1), m(1.5), m(1.5), m(0), m(0.15),
+                                                      mirror, silk, name))
+    f.write("T1 %d %d %d %d %d %d %s I %d N \"%s\"\n" % (m(0), m(1), m(1.5), m(1.5), m(0), m(0.15),
+                                                      mirror, silk, "VAL**"))
     
-    for d in package.data:
-        f.write(d.kicad_mod())
+    for data in package.batches():
+        for d in data:
+            f.write(d.kicad_mod())
 
     f.write("$EndMODULE %s\n" % name)
     
     if write_lib_header:
         f.write("$EndLIBRARY\n")
 
-def make_cairo_png(filename, scale, package):
-    import cairo
-    
+def draw_batched(ctx, package):
+    """Draw package on a Cairo context with one stroke or fill per group of primitives
+    sharing the same style. Groups are drawn in order of their first appearance. For
+    a PackageStream, primitives are grouped within each batch."""
+    for data in package.batches():
+        groups = {}
+        order = []
+        for d in data:
+            style = d.style()
+            if style not in groups:
+                groups[style] = []
+                order.append(style)
+            groups[style].append(d)
+
+        for style in order:
+            (op, color, width) = style
+            ctx.set_source_rgb(*color)
+            for d in groups[style]:
+                d.path(ctx)
+            if op == "fill":
+                ctx.fill()
+            else:
+                ctx.set_line_width(width)
+                ctx.stroke()
+
+def _cairo_size(scale, package):
     margin = 0.1 # mm
-    size = package.courtyard
+    size = common.transform_box(package.courtyard, package.transform)
     w = int((size[1][0] - size[0][0] + 2 * margin) * scale)
     h = int((size[1][1] - size[0][1] + 2 * margin) * scale)
-    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    return (w, h)
+
+def _cairo_render(surface, w, h, scale, package):
+    import cairo
+
     ctx = cairo.Context(surface)
 
     ctx.set_line_cap(cairo.LINE_CAP_ROUND)
@@ -104,18 +162,43 @@ def make_cairo_png(filename, scale, package):
     ctx.translate(w/2, h/2)
     ctx.scale(scale, scale)
 
-    for d in package.data:
-        d.draw(ctx)
+    draw_batched(ctx, package)
+
+def make_cairo_png(filename, scale, package):
+    import cairo
+    
+    package = package.converted("mm")
+    (w, h) = _cairo_size(scale, package)
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+    _cairo_render(surface, w, h, scale, package)
 
     surface.write_to_png(filename)
     return (w, h)
 
+def make_cairo_vector(filename, scale, package, format="pdf"):
+    """Write a PDF or SVG drawing of the package, scale is in points per mm"""
+    import cairo
+
+    package = package.converted("mm")
+    (w, h) = _cairo_size(scale, package)
+    if format == "pdf":
+        surface = cairo.PDFSurface(filename, w, h)
+    elif format == "svg":
+        surface = cairo.SVGSurface(filename, w, h)
+    else:
+        raise ValueError("Unsupported vector format %s" % format)
+    _cairo_render(surface, w, h, scale, package)
+
+    surface.finish()
+    return (w, h)
+
 def make_pil_png(f, scale, package):
     from PIL import Image, ImageDraw
     
+    package = package.converted("mm")
     scale = float(scale)
     margin = 0.1 # mm
-    size = package.courtyard
+    size = common.transform_box(package.courtyard, package.transform)
     size = ( (size[0][0] - margin, size[0][1] - margin),
              (size[1][0] + margin, size[1][1] + margin) )
     w = int((size[1][0] - size[0][0]) * scale)
@@ -128,12 +211,217 @@ def make_pil_png(f, scale, package):
     ctx.scale(scale, scale)
     ctx.translate(-size[0][0], -size[0][1])
 
-    for d in package.data:
-        d.draw(ctx)
+    for data in package.batches():
+        for d in data:
+            d.draw(ctx)
 
     im.save(f, "png")
     return (w, h)
 
+def _png_chunk(f, tag, data):
+    f.write(struct.pack(">I", len(data)))
+    f.write(tag)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+def _render_tile(scale, origin, extents, package, x, y, w, h, size, margin=0):
+    """Render the w*h pixel region with its upper left corner at pixel (x, y) of an
+    image of size pixels with its upper left corner at origin [mm]. Only
+    primitives overlapping the region are drawn. PIL rasterizes circles cut by the
+    image edge differently, so the region is drawn with margin more pixels on each
+    side, as far as the whole image goes, and cropped. Returns a PIL image."""
+    from PIL import Image, ImageDraw
+
+    left = min(margin, x)
+    top = min(margin, y)
+    right = max(0, min(margin, size[0] - x - w))
+    bottom = max(0, min(margin, size[1] - y - h))
+    (x, y) = (x - left, y - top)
+    (tw, th) = (w + left + right, h + top + bottom)
+
+    im = Image.new("RGBA", (tw, th))
+    # Region in mm, with a pixel of slack for rounding and line caps
+    x0 = origin[0] + (x - 1) / scale
+    y0 = origin[1] + (y - 1) / scale
+    x1 = origin[0] + (x + tw + 1) / scale
+    y1 = origin[1] + (y + th + 1) / scale
+    visible = numpy.nonzero((extents[:, 0] <= x1) & (extents[:, 2] >= x0) &
+                            (extents[:, 1] <= y1) & (extents[:, 3] >= y0))[0]
+    if len(visible) == 0:
+        return im.crop((left, top, left + w, top + h))
+
+    ctx = common.PilContext(ImageDraw.Draw(im))
+    ctx.offset = (x, y) # Applied after rounding, so tiles line up exactly
+    ctx.scale(scale, scale)
+    ctx.translate(-origin[0], -origin[1])
+
+    for i in visible:
+        package.data[i].draw(ctx)
+    if (tw, th) == (w, h):
+        return im
+    return im.crop((left, top, left + w, top + h))
+
+def _tile_setup(scale, package):
+    package = package.converted("mm").placed()
+    scale = float(scale)
+    margin = 0.1 # mm
+    size = package.courtyard
+    origin = (size[0][0] - margin, size[0][1] - margin)
+    w = int((size[1][0] + margin - origin[0]) * scale)
+    h = int((size[1][1] + margin - origin[1]) * scale)
+    extents = numpy.array([ d.extent() for d in package.data ], dtype=float).reshape(-1, 4)
+    # Largest circle diameter, tiles overlap by this much
+    circles = [ 0 ]
+    for d in package.data:
+        if isinstance(d, common.Circle):
+            circles.append(2 * d.size + d.width)
+        elif isinstance(d, common.PadArray) and d.shape == "circle":
+            circles.append(d.xsize)
+    return (scale, origin, w, h, extents, package, max(circles))
+
+def _tile_margin(circle, scale):
+    """Return the tile overlap in pixels for circles up to circle mm across"""
+    if circle == 0:
+        return 0
+    return int(math.ceil(circle * scale)) + 2
+
+def make_tiled_png(f, scale, package, bandheight=64):
+    """Render a PNG image like make_pil_png, but draw it in horizontal bands that are
+    compressed and written out one at a time. Peak memory is one band rather than the
+    whole image. f must be opened in binary mode."""
+    (scale, origin, w, h, extents, package, circle) = _tile_setup(scale, package)
+    margin = _tile_margin(circle, scale)
+
+    f.write(b"\x89PNG\r\n\x1a\n")
+    _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+    compressor = zlib.compressobj()
+    stride = w * 4
+    for y in range(0, h, bandheight):
+        bh = min(bandheight, h - y)
+        pixels = _render_tile(scale, origin, extents, package, 0, y, w, bh, (w, h), margin).tobytes()
+        # Each scanline is prefixed by its filter type, 0 (none)
+        rows = b"".join(b"\0" + pixels[r * stride:(r + 1) * stride] for r in range(0, bh))
+        data = compressor.compress(rows)
+        if data:
+            _png_chunk(f, b"IDAT", data)
+    _png_chunk(f, b"IDAT", compressor.flush())
+    _png_chunk(f, b"IEND", b"")
+    return (w, h)
+
+def make_png_pyramid(directory, scale, package, tilesize=256):
+    """Render a multi-resolution tile pyramid for a zoomable viewer. Tiles are written
+    as <directory>/<level>/<column>/<row>.png, where level 0 fits the whole image in
+    one tile and the highest level is drawn at the given scale. Each tile is rendered
+    on its own, so peak memory only depends on the tile size."""
+    (scale, origin, w, h, extents, package, circle) = _tile_setup(scale, package)
+
+    levels = 0
+    while max(w, h) > tilesize << levels:
+        levels += 1
+
+    for level in range(0, levels + 1):
+        s = scale / (1 << (levels - level))
+        lw = max(1, int(math.ceil(w / float(1 << (levels - level)))))
+        lh = max(1, int(math.ceil(h / float(1 << (levels - level)))))
+        for col in range(0, (lw + tilesize - 1) // tilesize):
+            coldir = os.path.join(directory, str(level), str(col))
+            if not os.path.isdir(coldir):
+                os.makedirs(coldir)
+            for row in range(0, (lh + tilesize - 1) // tilesize):
+                x = col * tilesize
+                y = row * tilesize
+                im = _render_tile(s, origin, extents, package, x, y,
+                                  min(tilesize, lw - x), min(tilesize, lh - y),
+                                  (lw, lh), _tile_margin(circle, s))
+                im.save(os.path.join(coldir, "%d.png" % row), "png")
+    return levels + 1
+
+# File name suffix of each output format, used when writing several formats at once
+format_suffix = { "kicad_mod": ".kicad_mod", "emp": ".emp", "cairo-png": "-cairo.png",
+                  "png": ".png", "tiled-png": "-tiled.png", "png-pyramid": "-tiles",
+                  "pdf": ".pdf", "svg": ".svg" }
+# Formats that are written in the calling thread by write_formats()
+text_formats = ("kicad_mod", "emp")
+
+def output_filename(outfile, format, compress=None):
+    """Return the file name for one of several formats written from outfile. Text
+    formats written compressed get the suffix of the compression method too."""
+    filename = os.path.splitext(outfile)[0] + format_suffix[format]
+    if format in text_formats:
+        filename += common.compression_suffix[compress]
+    return filename
+
+def write_format(format, filename, name, package, scale=8, compress=None, level=None):
+    """Write the package to filename in one output format"""
+    if format == "kicad_mod":
+        f = common.open_library(filename, "w", compress, level)
+        make_kicad_mod(f, name, package)
+        f.close()
+
+    elif format == "emp":
+        f = common.open_library(filename, "w", compress, level)
+        make_emp(f, name, package)
+        f.close()
+
+    elif format == "cairo-png":
+        make_cairo_png(filename, scale, package)
+
+    elif format in ("pdf", "svg"):
+        make_cairo_vector(filename, scale, package, format)
+
+    elif format == "png":
+        f = open(filename, "wb")
+        make_pil_png(f, scale, package)
+        f.close()
+
+    elif format == "tiled-png":
+        f = open(filename, "wb")
+        make_tiled_png(f, scale, package)
+        f.close()
+
+    elif format == "png-pyramid":
+        make_png_pyramid(filename, scale, package)
+
+    else:
+        raise ValueError("Unsupported output format %s" % format)
+
+def _write_worker(errors, *args):
+    try:
+        write_format(*args)
+    except Exception as e:
+        errors.append("%s: %s" % (args[1], e))
+        raise
+
+def write_formats(outputs, name, package, scale=8, compress=None, level=None, threads=False):
+    """Write one generated package in several formats. outputs is a list of (format,
+    file name). The package is generated once, then images are rendered by one worker
+    process each (or thread, if threads is True) while the text formats are written
+    in the calling thread."""
+    package = package.placed()
+    errors = []
+    workers = []
+    for (format, filename) in outputs:
+        if format in text_formats:
+            continue
+        args = (errors, format, filename, name, package, scale, compress, level)
+        if threads:
+            worker = threading.Thread(target=_write_worker, args=args)
+        else:
+            worker = multiprocessing.Process(target=_write_worker, args=args)
+        worker.start()
+        workers.append((worker, filename))
+
+    for (format, filename) in outputs:
+        if format in text_formats:
+            write_format(format, filename, name, package, scale, compress, level)
+
+    for (worker, filename) in workers:
+        worker.join()
+        if getattr(worker, "exitcode", 0):
+            errors.append("%s: writer exited with code %d" % (filename, worker.exitcode))
+    if errors:
+        raise RuntimeError("Failed to write " + ", ".join(errors))
+
 
 if __name__ == "__main__":
     # Parse command line
@@ -146,18 +434,37 @@ if __name__ == "__main__":
                       help="L1 - Terminal (lead) length (package-to-toe) [mm]", metavar="N")
     parser.add_option("--termwidth", dest="termwidth", type="float",
                       help="b - Terminal (lead) width (maximum) [mm]", metavar="N")
+    parser.add_option("--ball", dest="ball", type="float",
+                      help="Ball diameter (nominal), for BGA packages [mm]", metavar="N")
     parser.add_option("--density", "--density", dest="density",
                       help="IPC-7351 density level: L (least), N (nominal), M (most)")
     parser.add_option("--toe-protrusion", dest="jt", type="float",
                       help="Override toe protrusion (outside pad length) [mm]", metavar="N")
+    parser.add_option("--rotate", dest="rotate", type="float",
+                      help="Rotate the footprint [degrees]", metavar="N")
+    parser.add_option("--back", dest="back", action="store_true", default=False,
+                      help="Mirror the footprint for the back side of the board")
+    parser.add_option("--nm", dest="nm", action="store_true", default=False,
+                      help="Round the geometry to integer nanometres before writing it")
 
     group = optparse.OptionGroup(parser, "Output format options")
     group.add_option("--format", dest="format", default="kicad_mod",
                       help="Output file format: kicad_mod (new s-record file format), "
                      "emp (exported legacy format module), "
-                     "cairo-png (high quality image), png (image)", metavar="FORMAT")
+                     "cairo-png (high quality image), png (image), "
+                     "tiled-png (image drawn in bands, for large scales), "
+                     "png-pyramid (directory of zoomable image tiles), "
+                     "pdf, svg (vector drawings). Several comma separated formats "
+                     "are written from one generated footprint, to the output file "
+                     "name with a suffix for each format", metavar="FORMATS")
     group.add_option("--outfile", dest="outfile", default="out",
                       help="Output file name", metavar="FILE")
+    group.add_option("--compress", dest="compress",
+                     help="Compress kicad_mod or emp output: gzip or zstd", metavar="METHOD")
+    group.add_option("--level", dest="level", type="int",
+                     help="Compression level", metavar="N")
+    group.add_option("--threads", dest="threads", action="store_true", default=False,
+                     help="With several formats, render images on threads instead of processes")
     group.add_option("--scale", dest="pngscale", type="int", default="8",
                      help="Image scale in number of pixels per mm", metavar="N")
     parser.add_option_group(group)
@@ -167,14 +474,12 @@ if __name__ == "__main__":
     if not options.name:
         parser.error("-n argument is mandatory")
 
-    generator = None
-    if re.match("^QFP", options.name):
-        generator = qfp.Qfp()
-    if re.match("^SOIC", options.name):
-        generator = soic.Soic()
-    if re.match("^SOP", options.name):
-        generator = soic.Soic()
+    generator = make_generator(options.name)
+    if generator is None:
+        parser.error("Unsupported package type")
 
+    if options.ball:
+        generator.params.balldiameter = options.ball
     generator.parse_ipc_name(options.name)
     if options.density:
         generator.set_density(options.density)
@@ -187,25 +492,26 @@ if __name__ == "__main__":
     if options.jt:
         generator.params.JT = options.jt
 
-    package = generator.generate()
-
-    if options.format == "kicad_mod":
-        f = open(options.outfile, "w")
-        make_kicad_mod(f, options.name, package)
-        f.close()
-
-    elif options.format == "emp":
-        f = open(options.outfile, "w")
-        make_emp(f, options.name, package)
-        f.close()
+    package = generator.stream()
+    if options.rotate:
+        package.rotate(options.rotate)
+    if options.back:
+        package.mirror()
+    if options.nm:
+        package = package.converted("nm")
 
-    elif options.format == "cairo-png":
-        make_cairo_png(options.outfile, options.pngscale, package)
-
-    elif options.format == "png":
-        f = open(options.outfile, "w")
-        make_pil_png(f, options.pngscale, package)
-        f.close()
+    formats = options.format.split(",")
+    for format in formats:
+        if format not in format_suffix:
+            parser.error("Unsupported output format %s" % format)
+    if options.compress not in common.compression_suffix:
+        parser.error("Unsupported compression %s" % options.compress)
 
+    if len(formats) == 1:
+        write_format(formats[0], options.outfile, options.name, package,
+                     options.pngscale, options.compress, options.level)
     else:
-        parser.error("Unsupported output format")
+        outputs = [ (format, output_filename(options.outfile, format, options.compress))
+                    for format in formats ]
+        write_formats(outputs, options.name, package, options.pngscale,
+                      options.compress, options.level, options.threads)
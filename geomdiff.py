@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# Compare the geometry of two versions of a footprint library, for instance before
+# and after changing the density rules, and report what moved and by how much.
+#
+# Pads are matched by number, and silk lines by the nearest line in the other version
+# (endpoints in either order). Differences smaller than the tolerance are ignored.
+# The libraries can be .mod or .kicad_mod files (possibly compressed) or .pretty
+# directories. Modules are matched by name, or with --ignore-density by name without
+# the density level suffix, to compare the libraries of two density levels.
+#
+# Example:
+#   ./geomdiff.py --tolerance 0.01 old/standard-qfp-N.mod standard-qfp-N.mod
+#   ./geomdiff.py --ignore-density standard-qfp-L.mod standard-qfp-N.mod
+#
+
+import optparse
+import re
+import sys
+import numpy
+import modfile
+
+def strip_density(name):
+    """Return a module name without the IPC density level suffix (L, N or M), so
+    that the modules of libraries for different density levels can be matched"""
+    return re.sub(r"(?<=\d)[LNM]$", "", name)
+
+def outline(package):
+    """Return the courtyard of a placed package, or its bbox if it has no courtyard
+    (like packages read from files)"""
+    if hasattr(package, "courtyard"):
+        return package.courtyard
+    return package.bbox
+
+def line_distances(a, b):
+    """Return the matrix of distances between the lines of a and b, taken as the
+    largest endpoint distance with the endpoints in the best order"""
+    def d(p, q):
+        return numpy.hypot(p[:, numpy.newaxis, 0] - q[numpy.newaxis, :, 0],
+                           p[:, numpy.newaxis, 1] - q[numpy.newaxis, :, 1])
+    forward = numpy.maximum(d(a[:, 0:2], b[:, 0:2]), d(a[:, 2:4], b[:, 2:4]))
+    reverse = numpy.maximum(d(a[:, 0:2], b[:, 2:4]), d(a[:, 2:4], b[:, 0:2]))
+    return numpy.minimum(forward, reverse)
+
+def unique_keys(numbers):
+    """Make pad numbers unique by counting repeated numbers, so that the n:th pad
+    with a number is matched to the n:th pad with that number in the other version"""
+    if len(set(numbers)) == len(numbers):
+        return numpy.array(numbers, dtype=str)
+    seen = {}
+    keys = []
+    for n in numbers:
+        seen[n] = seen.get(n, 0) + 1
+        keys.append("%s#%d" % (n, seen[n]))
+    return numpy.array(keys, dtype=str)
+
+class ModuleDiff(object):
+    def __init__(self, name, status="changed"):
+        self.name = name
+        self.status = status   # "changed", "added" or "removed"
+        self.pads = []         # (number, dx, dy, dxsize, dysize, drotation, old layer, new layer)
+        self.pads_added = []   # Numbers of pads only in the new version
+        self.pads_removed = [] # Numbers of pads only in the old version
+        self.silk_moved = []   # Distance to the nearest new line, for each moved old line
+        self.silk_added = 0    # Number of new lines not near any old line
+        self.silk_removed = 0  # Number of old lines when there are no new lines
+        self.silk_width = []   # (old width, new width) of matched lines
+        self.courtyard = None  # Growth of the (left, top, right, bottom) edges
+
+    def __nonzero__(self):
+        return bool(self.status != "changed" or self.pads or self.pads_added or
+                    self.pads_removed or self.silk_moved or self.silk_added or
+                    self.silk_removed or self.silk_width or self.courtyard)
+    __bool__ = __nonzero__
+
+    def report(self):
+        """Return a list of lines describing the differences"""
+        if self.status != "changed":
+            return [ "%s: %s" % (self.name, self.status) ]
+        r = [ "%s:" % self.name ]
+        for (number, dx, dy, dw, dh, drot, oldlayer, newlayer) in self.pads:
+            changes = []
+            if dx or dy:
+                changes.append("moved %+.3f %+.3f" % (dx, dy))
+            if dw or dh:
+                changes.append("size %+.3f %+.3f" % (dw, dh))
+            if drot:
+                changes.append("rotation %+.1f" % drot)
+            if oldlayer != newlayer:
+                changes.append("layer %s -> %s" % (oldlayer, newlayer))
+            r.append("  pad %s: %s" % (number, ", ".join(changes)))
+        if self.pads_added:
+            r.append("  pads added: %s" % " ".join(self.pads_added))
+        if self.pads_removed:
+            r.append("  pads removed: %s" % " ".join(self.pads_removed))
+        if self.silk_moved:
+            r.append("  silk: %d lines moved, up to %.3f" % (len(self.silk_moved), max(self.silk_moved)))
+        if self.silk_added:
+            r.append("  silk: %d lines added" % self.silk_added)
+        if self.silk_removed:
+            r.append("  silk: %d lines removed" % self.silk_removed)
+        for (old, new) in self.silk_width:
+            r.append("  silk: line width %.3f -> %.3f" % (old, new))
+        if self.courtyard:
+            r.append("  courtyard: %+.3f %+.3f %+.3f %+.3f (left, top, right, bottom)" % self.courtyard)
+        return r
+
+def diff_packages(old, new, tolerance=0.01, name=None):
+    """Return a ModuleDiff with the differences between two versions of a package.
+    Differences up to tolerance (in mm, or degrees for rotations) are ignored."""
+    old = old.converted("mm").placed()
+    new = new.converted("mm").placed()
+    diff = ModuleDiff(name)
+
+    # Pads, matched by number
+    (oldnumbers, oldlayers, oldpads) = old.pad_table()
+    (newnumbers, newlayers, newpads) = new.pad_table()
+    (keys, i, j) = numpy.intersect1d(unique_keys(oldnumbers), unique_keys(newnumbers),
+                                     assume_unique=True, return_indices=True)
+    delta = newpads[j] - oldpads[i]
+    delta[:, 4] = (delta[:, 4] + 180) % 360 - 180
+    delta[numpy.abs(delta) <= tolerance] = 0
+    oldlayers = numpy.array(oldlayers, dtype=str).reshape(-1)[i]
+    newlayers = numpy.array(newlayers, dtype=str).reshape(-1)[j]
+    changed = delta.any(axis=1) | (oldlayers != newlayers)
+    # Report in the pad order of the old version
+    for k in numpy.nonzero(changed)[0][numpy.argsort(i[changed])].tolist():
+        diff.pads.append((oldnumbers[i[k]],) + tuple(delta[k].tolist()) +
+                         (oldlayers[k], newlayers[k]))
+    matched = numpy.zeros(len(oldnumbers), dtype=bool)
+    matched[i] = True
+    diff.pads_removed = [ n for (n, m) in zip(oldnumbers, matched.tolist()) if not m ]
+    matched = numpy.zeros(len(newnumbers), dtype=bool)
+    matched[j] = True
+    diff.pads_added = [ n for (n, m) in zip(newnumbers, matched.tolist()) if not m ]
+
+    # Silk lines, matched to the nearest line
+    oldlines = old.line_table()[1]
+    newlines = new.line_table()[1]
+    if len(oldlines) and len(newlines):
+        d = line_distances(oldlines, newlines)
+        nearest = d.argmin(axis=1)
+        dist = d[numpy.arange(len(oldlines)), nearest]
+        moved = dist > tolerance
+        diff.silk_moved = dist[moved].tolist()
+        # New lines that are neither near an old line nor where an old line moved to
+        added = d.min(axis=0) > tolerance
+        added[nearest[moved]] = False
+        diff.silk_added = int(added.sum())
+        same = dist <= tolerance
+        widths = numpy.column_stack((oldlines[same, 4], newlines[nearest[same], 4]))
+        diff.silk_width = [ tuple(w) for w in widths[numpy.abs(widths[:, 1] - widths[:, 0]) > tolerance].tolist() ]
+    else:
+        diff.silk_removed = len(oldlines)
+        diff.silk_added = len(newlines)
+
+    # Courtyard
+    (a, b) = (outline(old), outline(new))
+    growth = (a[0][0] - b[0][0], a[0][1] - b[0][1], b[1][0] - a[1][0], b[1][1] - a[1][1])
+    if max(abs(g) for g in growth) > tolerance:
+        diff.courtyard = growth
+    return diff
+
+def diff_libraries(oldpath, newpath, tolerance=0.01, key=None):
+    """Compare two libraries module by module. Returns a list of ModuleDiff for the
+    modules that differ, in the order of the new library, with removed modules last.
+    Modules are matched by name, or by key(name) if key is given, for instance
+    strip_density to compare libraries for two density levels."""
+    if key is None:
+        key = lambda name: name
+    old = dict( (key(name), (name, package)) for (name, package) in modfile.read_library(oldpath) )
+    seen = set()
+    result = []
+    for (name, package) in modfile.read_library(newpath):
+        seen.add(key(name))
+        if key(name) not in old:
+            result.append(ModuleDiff(name, "added"))
+            continue
+        diff = diff_packages(old[key(name)][1], package, tolerance, name)
+        if diff:
+            result.append(diff)
+    for k in sorted(set(old) - seen):
+        result.append(ModuleDiff(old[k][0], "removed"))
+    return result
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="Usage: %prog [options] old new",
+                                   description="Compare the geometry of two footprint libraries. "
+                                   "The libraries may be .mod, .kicad_mod or .pretty.")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=0.01,
+                      help="Ignore differences up to this size [mm or degrees]", metavar="N")
+    parser.add_option("--summary", dest="summary", action="store_true", default=False,
+                      help="Only print the names of the modules that differ")
+    parser.add_option("--ignore-density", dest="ignore_density", action="store_true", default=False,
+                      help="Match modules by name without the density level suffix (L, N or M), "
+                      "to compare libraries for different density levels")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("Need an old and a new library")
+
+    diffs = diff_libraries(args[0], args[1], options.tolerance,
+                           strip_density if options.ignore_density else None)
+    for diff in diffs:
+        if options.summary:
+            print("%s: %s" % (diff.name, diff.status))
+        else:
+            print("\n".join(diff.report()))
+    sys.exit(1 if diffs else 0)
@@ -3,8 +3,14 @@
 from qfp import Qfp
 from soic import Soic
 import footprinter
+import common
+import optparse
+import os
+import math
 import time
+import collections
 import StringIO
+import multiprocessing
 
 # Packages specified in JEDEC MS-026D
 qfps = [ # lead span x, lead span y, pitch, pins
@@ -86,58 +92,193 @@ soics = [ # lead span, pitch, length, pins, lead length
          (6.40, 0.65,  9.70, 28, 1.00, "TSSOP-28"),   # JEDEC MO-153
          # These are defined for three pitches and three body widths...
          ]
+
+densities = "LNM" # Density levels of the libraries, all built in one pass
+
+# Ways to split the libraries into shards, see shard_name()
+shard_keys = ("family", "pitch", "size")
+size_buckets = (5, 10, 20, 40) # [mm] Largest lead span of each size shard
+
+def qfp_modules():
+    """Return (package name without density, kind, parameters) for the modules of
+    the QFP libraries"""
+    return [ ("QFP%dP%dX%d-%d" % (p[2] * 100, (p[0] + 2) * 100, (p[1] + 2) * 100, p[3]), "qfp", p)
+             for p in qfps ]
+
+def sop_modules():
+    """Return (package name without density, kind, parameters) for the modules of
+    the SOP libraries"""
+    modules = []
+    for p in soics:
+        if p[1] == 1.27:
+            name = "SOIC"
+        else:
+            name = "SOP"
+        modules.append(("%s%dP%d-%d" % (name, p[1] * 100, (p[0]) * 100, p[3]), "sop", p))
+    return modules
+
+def make_packages(basename, kind, p, densities):
+    """Return a PackageStream for each density level of a module of the standard
+    libraries. The density-independent part is generated once for all of them."""
+    if kind == "qfp":
+        generator = Qfp()
+        generator.parse_ipc_name(basename)
+        return generator.variants(densities)
+    generator = Soic()
+    generator.parse_ipc_name(basename)
+    generator.params.termlen = p[4]
+    packages = generator.variants(densities)
+    body = generator.params.l - 2 * generator.params.termlen
+    for package in packages:
+        package.description = "%s, %.02fmm pitch, %.2fmm body" % (p[5], p[1], body)
+    return packages
+
+def shard_name(kind, p, shard):
+    """Return the shard of a module when splitting by shard (family, pitch or size)"""
+    if shard == "family":
+        return "QFP" if kind == "qfp" else p[5].split("-")[0]
+    elif shard == "pitch":
+        return "P%03d" % round((p[2] if kind == "qfp" else p[1]) * 100)
+    # Lead span: QFP rows have the body size, SOP rows the lead span
+    span = p[0] + 2 if kind == "qfp" else p[0]
+    for bucket in size_buckets:
+        if span <= bucket:
+            return "S%02d" % bucket
+    return "S%02d" % math.ceil(span)
+
+def write_extras(library, packagename, package, options, pool, results):
+    """Write the outputs besides the .mod library for one module: a kicad_mod file in
+    <library>.pretty and a thumbnail image in <library>-thumbnails. Thumbnails are
+    rendered by the pool while the next modules are generated, or right away if there
+    is no pool."""
+    if options.pretty:
+        directory = library + ".pretty"
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        footprinter.write_format("kicad_mod", os.path.join(directory, packagename + ".kicad_mod"),
+                                 packagename, package)
+    if options.thumbnails:
+        directory = library + "-thumbnails"
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        args = ("png", os.path.join(directory, packagename + ".png"),
+                packagename, package, options.thumbnails)
+        if pool is None:
+            footprinter.write_format(*args)
+        else:
+            results.append(pool.apply_async(footprinter.write_format, args))
+
+def build_libraries(libraries, modules, options, pool=None, results=None):
+    """Generate the modules, a list of (package name without density, kind,
+    parameters), and write them as <library>.mod with the extras, for the library
+    names in libraries, one for each density level. All libraries are written in one
+    pass over the modules. Returns a list of write_library() results."""
+    extras = options.pretty or options.thumbnails
+    data = [ StringIO.StringIO() for library in libraries ]
+    offsets = [ [] for library in libraries ]
+    for (basename, kind, p) in modules:
+        packages = make_packages(basename, kind, p, densities)
+        for (i, (library, density, package)) in enumerate(zip(libraries, densities, packages)):
+            packagename = basename + density
+            if extras:
+                # Generate once for all outputs
+                package = package.placed()
+                write_extras(library, packagename, package, options, pool, results)
+            offsets[i].append((packagename, data[i].tell()))
+            footprinter.make_emp(data[i], packagename, package, False)
+    return [ write_library(library, d.getvalue(), o, options)
+             for (library, d, o) in zip(libraries, data, offsets) ]
+
+def write_library(library, data, offsets, options):
+    """Write <library>.mod with the module text data, and an index of the modules in
+    offsets, a list of (package name, offset in data). Returns (library file name,
+    [(package name, offset)]), where offset is where the $MODULE line of the module
+    starts in the uncompressed library file."""
+    header = "PCBNEW-LibModule-V1  %s\n" % time.asctime()
+    header += "$INDEX\n"
+    for (packagename, offset) in offsets:
+        header += "%s\n" % packagename
+    header += "$EndINDEX\n"
+    filename = "%s.mod%s" % (library, common.compression_suffix[options.compress])
+    f = common.open_library(filename, "w", options.compress, options.level)
+    f.write(header)
+    f.write(data)
+    f.write("$EndLIBRARY\n")
+    f.close()
+    return (filename, [ (packagename, len(header) + offset) for (packagename, offset) in offsets ])
+
+def write_manifest(filename, shards):
+    """Write a manifest of the shards of a library, one line per module with the
+    module name, shard file name and offset of the module in the shard, separated by
+    tabs. shards is a list of write_library() results."""
+    f = open(filename, "w")
+    f.write("# module\tshard\toffset\n")
+    for (shard, offsets) in shards:
+        for (packagename, offset) in offsets:
+            f.write("%s\t%s\t%d\n" % (packagename, os.path.basename(shard), offset))
+    f.close()
+
 if __name__ == "__main__":
-    for density in "LNM":
-        index = []
-        data = StringIO.StringIO()
-        
-        for p in qfps:
-            packagename = "QFP%dP%dX%d-%d%s" % (p[2] * 100, (p[0] + 2) * 100, (p[1] + 2) * 100, p[3], density)
-            index.append(packagename)
-            
-            generator = Qfp()
-            generator.parse_ipc_name(packagename)
-            package = generator.generate()
-            footprinter.make_emp(data, packagename, package, False)        
-    
-        f = open("standard-qfp-%s.mod" % density, "w")
-        
-        f.write("PCBNEW-LibModule-V1  %s\n" % time.asctime())
-        f.write("$INDEX\n")
-        for name in index:
-            f.write("%s\n" % name)
-        f.write("$EndINDEX\n")
-        f.write(data.getvalue())
-        f.write("$EndLIBRARY\n")
-        f.close()
-        
-    for density in "LNM":
-        index = []
-        data = StringIO.StringIO()
-        
-        for p in soics:
-            if p[1] == 1.27:
-                name = "SOIC"
+    parser = optparse.OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("--compress", dest="compress",
+                      help="Compress the libraries: gzip or zstd", metavar="METHOD")
+    parser.add_option("--level", dest="level", type="int",
+                      help="Compression level", metavar="N")
+    parser.add_option("--pretty", dest="pretty", action="store_true", default=False,
+                      help="Also write each library as a .pretty directory of kicad_mod files")
+    parser.add_option("--thumbnails", dest="thumbnails", type="int",
+                      help="Also render a PNG thumbnail of each module at this scale "
+                      "[pixels per mm]", metavar="N")
+    parser.add_option("--shard", dest="shard",
+                      help="Split each library into shards by family, pitch or size (lead span), "
+                      "with a <library>.manifest file listing where each module is", metavar="KEY")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="Number of libraries or shards to build at a time", metavar="N")
+    (options, args) = parser.parse_args()
+    if options.compress not in common.compression_suffix:
+        parser.error("Unsupported compression method")
+    if options.shard is not None and options.shard not in shard_keys:
+        parser.error("Unsupported shard key %s" % options.shard)
+
+    # Shards of the library families, as (shard library names (one per density
+    # level), modules). Without sharding each family is one shard.
+    families = []
+    for (family, modules) in (("qfp", qfp_modules()), ("sop", sop_modules())):
+        libraries = [ "standard-%s-%s" % (family, density) for density in densities ]
+        shards = collections.OrderedDict()
+        for module in modules:
+            suffix = ""
+            if options.shard is not None:
+                suffix = "-" + shard_name(module[1], module[2], options.shard)
+            shards.setdefault(suffix, []).append(module)
+        families.append((libraries, [ ([ library + suffix for library in libraries ], modules)
+                                      for (suffix, modules) in shards.items() ]))
+
+    # Shards are independent, with several jobs each is built by one process, with
+    # thumbnails rendered by the same process. Otherwise the pool renders thumbnails.
+    pool = None
+    if options.jobs > 1:
+        pool = multiprocessing.Pool(options.jobs)
+    elif options.thumbnails:
+        pool = multiprocessing.Pool()
+    results = []
+    built = []
+    for (libraries, shards) in families:
+        for (names, modules) in shards:
+            if options.jobs > 1:
+                built.append(pool.apply_async(build_libraries, (names, modules, options)))
             else:
-                name = "SOP"
-            packagename = "%s%dP%d-%d%s" % (name, p[1] * 100, (p[0]) * 100, p[3], density)
-            index.append(packagename)
-            
-            generator = Soic()
-            generator.parse_ipc_name(packagename)
-            generator.params.termlen = p[4]
-            package = generator.generate()
-            body = generator.params.l - 2 * generator.params.termlen
-            package.description = "%s, %.02fmm pitch, %.2fmm body" % (p[5], p[1], body)
-            footprinter.make_emp(data, packagename, package, False)        
-    
-        f = open("standard-sop-%s.mod" % density, "w")
-        
-        f.write("PCBNEW-LibModule-V1  %s\n" % time.asctime())
-        f.write("$INDEX\n")
-        for name in index:
-            f.write("%s\n" % name)
-        f.write("$EndINDEX\n")
-        f.write(data.getvalue())
-        f.write("$EndLIBRARY\n")
-        f.close()
\ No newline at end of file
+                built.append(build_libraries(names, modules, options, pool, results))
+    if options.jobs > 1:
+        built = [ b.get() for b in built ]
+    if options.shard is not None:
+        for (libraries, shards) in families:
+            for (i, library) in enumerate(libraries):
+                write_manifest(library + ".manifest", [ b[i] for b in built[:len(shards)] ])
+            built = built[len(shards):]
+
+    if pool is not None:
+        pool.close()
+        for r in results:
+            r.get() # Raises any exception from rendering
+        pool.join()
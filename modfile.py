@@ -2,22 +2,32 @@
 # images of modules
 
 import sys
+import io
 import os
 import re
-from common import Package, Line, Pad
+from common import Package, Line, Pad, open_library, Nm, NM_PER_DECIMIL, to_nm, legacy_pad_layers
+from common import compression_suffix
 import footprinter
 
+modulere = re.compile("^\$MODULE (.*)\n$")
+endmodulere = re.compile("^\$EndMODULE (.*)\n$")
+
 def decimil2mm(dmil):
     """Convert kicad's old 1/10 mil format to mm"""
     return dmil * 0.00256
 
 class Mod(object):
-    def __init__(self, filename):
-        self.f = open(filename)
+    def __init__(self, filename, nm=False):
+        self.filename = filename
+        self.nm = nm # Keep lengths as exact integer nanometres (common.Nm)
+        self.f = open_library(filename)
         self.name = os.path.split(filename)[1]
         self.index = []
         self.mods = []
+        self.names = [] # Module names, in the same order as mods
         self.unit_is_mm = False
+        self.xs = []
+        self.ys = []
         
     def read_index(self):
         for line in self.f:
@@ -29,26 +39,66 @@ class Mod(object):
                     self.index.append(line.strip())
 
     def parse(self):
-        self.f.seek(0)
-        modulere = re.compile("^\$MODULE (.*)\n$")
-        endmodulere = re.compile("^\$EndMODULE (.*)\n$")
+        # Reopen rather than seek, compressed streams can't go backwards
+        self.f.close()
+        self.f = open_library(self.filename)
         
         for line in self.f:
             match = modulere.match(line)
             if match:
                 #print("Module %s" % match.group(1))
-                package = Package()
-                self.mods.append(package)
-                
-                for line in self.f:
-                    if endmodulere.match(line):
-                        break
-                    self.parse_line(package, line)
+                self.parse_module(match.group(1))
             elif line.startswith("Units"):
                 if line == "Units mm\n":
                     self.unit_is_mm = True
 
+    def parse_module(self, name):
+        """Parse the lines of a module up to $EndMODULE, after its $MODULE line"""
+        package = Package()
+        package.description = "" # Unless the module has a Cd line
+        if self.nm:
+            package.units = "nm"
+        self.mods.append(package)
+        self.names.append(name)
+        # Points are collected per module and the bbox computed once at the end
+        self.xs = []
+        self.ys = []
+        
+        for line in self.f:
+            if endmodulere.match(line):
+                break
+            self.parse_line(package, line)
+        package.expand_bbox_bulk(self.xs, self.ys)
+        return package
+
+    def parse_at(self, offset):
+        """Parse only the module whose $MODULE line starts at offset in the
+        (uncompressed) file, like the offsets in a makelibs manifest. Returns the
+        package."""
+        # The units are in the header
+        self.f.close()
+        self.f = open_library(self.filename)
+        for line in self.f:
+            if line == "Units mm\n":
+                self.unit_is_mm = True
+            elif line.startswith("$"):
+                break
+        self.f.close()
+        self.f = open_library(self.filename)
+        try:
+            self.f.seek(offset)
+        except (AttributeError, io.UnsupportedOperation):
+            self.f.read(offset) # Compressed streams can only skip ahead by reading
+        match = modulere.match(next(iter(self.f), ""))
+        if match is None:
+            raise ValueError("No module at offset %d of %s" % (offset, self.filename))
+        return self.parse_module(match.group(1))
+
     def dim(self, dmilstring):
+        if self.nm:
+            if self.unit_is_mm:
+                return to_nm(float(dmilstring))
+            return Nm(int(dmilstring) * NM_PER_DECIMIL)
         if self.unit_is_mm:
             return float(dmilstring)
         else:
@@ -61,7 +111,7 @@ class Mod(object):
         elif t[0] == "Li":
             return
         elif t[0] == "Cd":
-            return
+            package.description = line[3:].rstrip("\r\n")
         elif t[0] == "Sc":
             return
         elif t[0] == "AR":
@@ -75,8 +125,8 @@ class Mod(object):
             start = (self.dim(t[1]), self.dim(t[2]))
             end = (self.dim(t[3]), self.dim(t[4]))
             package.data.append(Line( start, end, self.dim(t[5]) ))
-            package.expand_bbox(start)
-            package.expand_bbox(end)
+            self.xs += (start[0], end[0])
+            self.ys += (start[1], end[1])
             #line.layer = t[6]
         elif t[0] == "$PAD":
             pad = Pad()
@@ -85,13 +135,16 @@ class Mod(object):
             for line in self.f:
                 t = line.split()
                 if t[0] == "Sh":
+                    number = t[1].strip('"')
+                    pad.number = int(number) if number.isdigit() else number
                     pad.xsize = self.dim(t[3])
                     pad.ysize = self.dim(t[4])
                     pad.rotation = float(t[7]) / 10.0
                 elif t[0] == "Dr":
                     pass
                 elif t[0] == "At":
-                    pass
+                    if t[3:4] == [ legacy_pad_layers["B"] ]:
+                        pad.layer = "B.Cu"
                 elif t[0] == "Ne":
                     pass
                 elif t[0] == "Po":
@@ -99,13 +152,118 @@ class Mod(object):
                     pad.y = self.dim(t[2])
                 elif t[0] == "$EndPAD":
                     maxdim = max(pad.xsize, pad.ysize) / 2.0
-                    package.expand_bbox((pad.x - maxdim, pad.y - maxdim))
-                    package.expand_bbox((pad.x + maxdim, pad.y + maxdim))
+                    self.xs += (pad.x - maxdim, pad.x + maxdim)
+                    self.ys += (pad.y - maxdim, pad.y + maxdim)
                     return
         else:
             return
 
-        
+
+padre = re.compile(r"\(pad\s+(\S+)\s+\S+\s+\S+\s+\(at\s+([-\d.]+)\s+([-\d.]+)(?:\s+([-\d.]+))?\)"
+                   r"\s+\(size\s+([-\d.]+)\s+([-\d.]+)\)(?:.*\(layers\s+(\S+))?")
+fplinere = re.compile(r"\(fp_line\s+\(start\s+([-\d.]+)\s+([-\d.]+)\)\s+\(end\s+([-\d.]+)\s+([-\d.]+)\)"
+                      r"\s+\(layer\s+(\S+)\)\s+\(width\s+([-\d.]+)\)")
+descrre = re.compile(r'^\s*\(descr\s+"(.*)"\)')
+
+def parse_kicad_mod(f):
+    """Parse the pads and lines of a kicad_mod file, returns (name, package). Only
+    files with one pad or line per text line are understood, like the ones written
+    by KiCad and footprinter.make_kicad_mod()."""
+    name = None
+    package = Package()
+    package.description = ""
+    xs = []
+    ys = []
+    for line in f:
+        if name is None and line.startswith("(module "):
+            name = line.split()[1]
+            continue
+        match = descrre.match(line)
+        if match:
+            package.description = match.group(1)
+            continue
+        match = padre.search(line)
+        if match:
+            number = match.group(1).strip('"')
+            pad = Pad(int(number) if number.isdigit() else number)
+            pad.x = float(match.group(2))
+            pad.y = float(match.group(3))
+            pad.rotation = float(match.group(4) or 0)
+            pad.xsize = float(match.group(5))
+            pad.ysize = float(match.group(6))
+            if match.group(7) is not None:
+                pad.layer = match.group(7)
+            package.data.append(pad)
+            maxdim = max(pad.xsize, pad.ysize) / 2.0
+            xs += (pad.x - maxdim, pad.x + maxdim)
+            ys += (pad.y - maxdim, pad.y + maxdim)
+            continue
+        match = fplinere.search(line)
+        if match:
+            (x0, y0, x1, y1) = [ float(v) for v in match.group(1, 2, 3, 4) ]
+            l = Line( (x0, y0), (x1, y1), float(match.group(6)) )
+            l.layer = match.group(5)
+            package.data.append(l)
+            xs += (x0, x1)
+            ys += (y0, y1)
+    package.expand_bbox_bulk(xs, ys)
+    return (name, package)
+
+def kicad_mod_name(path):
+    """Return the module name for a .kicad_mod file name, which may have a
+    compression suffix (.kicad_mod.gz), or None for other files"""
+    filename = os.path.split(path)[1]
+    for suffix in compression_suffix.values():
+        if filename.endswith(".kicad_mod" + suffix):
+            return filename[:-len(".kicad_mod" + suffix)]
+    return None
+
+def read_library(path):
+    """Iterate over (name, package) for all modules of a library: a .mod file, a
+    .kicad_mod file (both possibly compressed) or a .pretty directory of them"""
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if kicad_mod_name(filename) is not None:
+                for module in read_library(os.path.join(path, filename)):
+                    yield module
+    elif kicad_mod_name(path) is not None:
+        f = open_library(path)
+        (name, package) = parse_kicad_mod(f)
+        f.close()
+        yield (name or kicad_mod_name(path), package)
+    else:
+        mod = Mod(path)
+        mod.parse()
+        mod.f.close()
+        for module in zip(mod.names, mod.mods):
+            yield module
+
+def read_manifest(filename):
+    """Read a manifest of a sharded library, written by makelibs --shard. Returns a
+    dict of module name -> (shard file name, offset of the module in the shard)."""
+    directory = os.path.dirname(filename)
+    manifest = {}
+    for line in open(filename):
+        if line.startswith("#"):
+            continue
+        (name, shard, offset) = line.rstrip("\n").split("\t")
+        manifest[name] = (os.path.join(directory, shard), int(offset))
+    return manifest
+
+def read_module(manifest, name):
+    """Return the package of one module of a sharded library, parsing only that
+    module from its shard. manifest is a manifest file name or a dict from
+    read_manifest()."""
+    if not isinstance(manifest, dict):
+        manifest = read_manifest(manifest)
+    if name not in manifest:
+        raise KeyError("Module %s is not in the manifest" % name)
+    (filename, offset) = manifest[name]
+    mod = Mod(filename)
+    package = mod.parse_at(offset)
+    mod.f.close()
+    return package
+
 if __name__ == "__main__":
     mod = Mod(sys.argv[1])
     mod.read_index()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# Merge several legacy .mod libraries into one.
+#
+# Module blocks ($MODULE ... $EndMODULE) are copied verbatim without being parsed.
+# The inputs are read twice: the first pass only collects module names, so that name
+# collisions can be resolved and a sorted $INDEX written before any module. The
+# second pass is a k-way merge of the module blocks by name, holding at most one
+# block per input in memory. If every input is sorted by name, so is the output.
+# Files are read in large pieces and split with regular expressions, rather than
+# line by line, so merging runs at close to the speed of reading the files.
+#
+# Example:
+#   ./modmerge.py -o combined.mod standard-qfp-N.mod standard-sop-N.mod vendor.mod.gz
+#
+
+import optparse
+import re
+import heapq
+import time
+import common
+
+policies = ("first", "last", "rename", "error")
+
+modulere = re.compile(r"^\$MODULE (.*?)\r?$", re.M)
+endmodulere = re.compile(r"^\$EndMODULE.*\n?", re.M)
+
+def chunks(filename, blocksize=1 << 20):
+    """Iterate over the text of a library in large pieces that end at line ends"""
+    f = common.open_library(filename)
+    rest = ""
+    for block in iter(lambda: f.read(blocksize), ""):
+        block = rest + block
+        end = block.rfind("\n") + 1
+        rest = block[end:]
+        if end:
+            yield block[:end]
+    if rest:
+        yield rest
+    f.close()
+
+def library_units(filename):
+    """Return "mm" for libraries with a "Units mm" line in the header, otherwise None
+    (1/10 mil)"""
+    for text in chunks(filename):
+        m = modulere.search(text)
+        header = text if m is None else text[:m.start()]
+        if re.search(r"^Units\s+mm", header, re.M):
+            return "mm"
+        if m is not None:
+            return None
+    return None
+
+def scan(filename):
+    """Return (module names in file order, units) of a library"""
+    names = []
+    for text in chunks(filename):
+        names.extend(modulere.findall(text))
+    return (names, library_units(filename))
+
+def resolve(libraries, policy="first"):
+    """Decide which modules to keep. libraries is a list of name lists, one per input
+    in file order. Returns one list per input with the output name of each module,
+    or None for modules that are left out."""
+    owner = {}
+    for (i, names) in enumerate(libraries):
+        for (j, name) in enumerate(names):
+            if name in owner:
+                if policy == "error":
+                    raise ValueError("Module %s is in more than one library" % name)
+                if policy == "first":
+                    continue
+            owner.setdefault(name, []).append((i, j))
+
+    result = [ [ None ] * len(names) for names in libraries ]
+    taken = set(owner)
+    for (name, places) in owner.items():
+        if policy == "last":
+            places = places[-1:]
+        (i, j) = places[0]
+        result[i][j] = name
+        # Later modules with the same name get the first free name_2, name_3, ...
+        n = 2
+        for (i, j) in places[1:]:
+            while "%s_%d" % (name, n) in taken:
+                n += 1
+            result[i][j] = "%s_%d" % (name, n)
+            taken.add(result[i][j])
+    return result
+
+def module_blocks(filename):
+    """Iterate over (name, text) of the modules of a library, in file order. The text
+    is the whole block from $MODULE to $EndMODULE."""
+    pending = None # Start of a block that continues in the next piece
+    for text in chunks(filename):
+        pos = 0
+        while True:
+            if pending is None:
+                m = modulere.search(text, pos)
+                if m is None:
+                    break
+                pos = m.start()
+                pending = ""
+            end = endmodulere.search(text, pos)
+            if end is None:
+                pending += text[pos:]
+                break
+            block = pending + text[pos:end.end()]
+            pos = end.end()
+            pending = None
+            yield (modulere.match(block).group(1), block)
+
+def blocks(filename, outnames, number):
+    """Iterate over (output name, input number, block number, text) for the modules
+    of a library that are kept. The module name is changed in the $MODULE, Li and
+    $EndMODULE lines of renamed modules, everything else is copied as it is."""
+    for (j, (name, block)) in enumerate(module_blocks(filename)):
+        outname = outnames[j]
+        if outname is None:
+            continue
+        if outname != name:
+            block = modulere.sub("$MODULE %s" % outname, block, 1)
+            block = re.sub(r"(?m)^Li .*$", "Li %s" % outname, block, 1)
+            block = endmodulere.sub("$EndMODULE %s\n" % outname, block, 1)
+        yield (outname, number, j, block)
+
+def merge_libraries(inputs, output, policy="first", compression=None, level=None):
+    """Merge the .mod libraries in the list inputs into the file output. Returns
+    (number of modules written, number left out, number renamed)."""
+    if policy not in policies:
+        raise ValueError("Unsupported collision policy %s" % policy)
+    scans = [ scan(filename) for filename in inputs ]
+    if len(set(units for (names, units) in scans)) > 1:
+        raise ValueError("Libraries use different units and can't be copied verbatim")
+    outnames = resolve([ names for (names, units) in scans ], policy)
+
+    index = sorted(name for names in outnames for name in names if name is not None)
+    f = common.open_library(output, "w", compression, level)
+    f.write("PCBNEW-LibModule-V1  %s\n" % time.asctime())
+    if scans and scans[0][1] == "mm":
+        f.write("Units mm\n")
+    f.write("$INDEX\n")
+    for name in index:
+        f.write("%s\n" % name)
+    f.write("$EndINDEX\n")
+    for (name, i, j, block) in heapq.merge(*[ blocks(filename, outnames[i], i)
+                                              for (i, filename) in enumerate(inputs) ]):
+        f.write(block)
+    f.write("$EndLIBRARY\n")
+    f.close()
+
+    total = sum(len(names) for (names, units) in scans)
+    renamed = sum(1 for ((names, units), out) in zip(scans, outnames)
+                  for (a, b) in zip(names, out) if b is not None and a != b)
+    return (len(index), total - len(index), renamed)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="Usage: %prog [options] library.mod ...",
+                                   description="Merge .mod libraries, copying the modules verbatim")
+    parser.add_option("-o", "--outfile", dest="outfile",
+                      help="Output library file name", metavar="FILE")
+    parser.add_option("--collision", dest="collision", default="first",
+                      help="What to do with modules that have the same name: first (keep "
+                      "the first), last (keep the last), rename (add _2, _3, ...) or error",
+                      metavar="POLICY")
+    parser.add_option("--compress", dest="compress",
+                      help="Compress the output: gzip or zstd", metavar="METHOD")
+    parser.add_option("--level", dest="level", type="int",
+                      help="Compression level", metavar="N")
+    (options, args) = parser.parse_args()
+
+    if not options.outfile:
+        parser.error("-o argument is mandatory")
+    if not args:
+        parser.error("No libraries given")
+    if options.collision not in policies:
+        parser.error("Unsupported collision policy %s" % options.collision)
+    if options.compress not in common.compression_suffix:
+        parser.error("Unsupported compression method")
+
+    try:
+        (written, dropped, renamed) = merge_libraries(args, options.outfile, options.collision,
+                                                      options.compress, options.level)
+    except ValueError as e:
+        parser.error(str(e))
+    print("%d modules written, %d left out, %d renamed" % (written, dropped, renamed))
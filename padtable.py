@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# Export the pads and silk lines of whole footprint libraries as column tables, for
+# assembly and analysis tools.
+#
+# Three tables are written: modules (module id, library, name), pads (module id,
+# number, layer, x, y, xsize, ysize, rotation) and lines (module id, layer, x0, y0,
+# x1, y1, width). Lengths are in mm and rotations in degrees. The output formats are
+# NumPy .npz (one array per column, named table_column), CSV (one file per table) and
+# Parquet (one file per table, needs pyarrow). Rows are collected for a batch of
+# modules at a time and then written with one call per column or file.
+#
+# .mod libraries are read straight into columns, see mod_tables(). Other libraries
+# and generated footprints go through Package.pad_table() and line_table().
+#
+# Example:
+#   ./padtable.py -o standard standard-qfp-N.mod vendor.pretty -n BGA256C100P16X16_1700X1700
+#
+
+import optparse
+import os
+import re
+import csv
+import numpy
+import footprinter
+import modfile
+import modmerge
+from common import legacy_layers, legacy_pad_layers
+
+pad_columns = ("module", "number", "layer", "x", "y", "xsize", "ysize", "rotation")
+line_columns = ("module", "layer", "x0", "y0", "x1", "y1", "width")
+module_columns = ("module", "library", "name")
+
+shre = re.compile(r'^Sh "([^"]*)" \S+ (\S+) (\S+) \S+ \S+ (\S+)', re.M)
+atre = re.compile(r"^At \S+ \S+ (\S+)", re.M)
+pore = re.compile(r"^Po (\S+) (\S+)\r?$", re.M) # Pad positions, module positions have more fields
+dsre = re.compile(r"^DS (\S+) (\S+) (\S+) (\S+) (\S+) (\S+)", re.M)
+silk_layers = dict( (n, layer) for (layer, n) in legacy_layers.items() )
+
+def mod_tables(filename):
+    """Iterate over (name, numbers, pad layers, pads, line layers, lines) for the
+    modules of a .mod library, with the tables like Package.pad_table() and
+    line_table() return them. The pad and line records are picked out of the module
+    text with regular expressions, without making any Pad or Line objects."""
+    scale = 1.0 if modmerge.library_units(filename) == "mm" else modfile.decimil2mm(1.0)
+    back = legacy_pad_layers["B"]
+    for (name, text) in modmerge.module_blocks(filename):
+        sh = shre.findall(text)
+        at = atre.findall(text)
+        po = pore.findall(text)
+        if not len(sh) == len(at) == len(po):
+            raise ValueError("Can't read the pads of module %s" % name)
+        pads = numpy.empty((len(sh), 5))
+        if sh:
+            fields = numpy.array(sh)
+            pads[:, 0:2] = numpy.array(po, dtype=float) * scale
+            pads[:, 2:4] = fields[:, 1:3].astype(float) * scale
+            pads[:, 4] = fields[:, 3].astype(float) / 10.0
+        numbers = [ str(int(n)) if n.isdigit() else n for (n, w, h, r) in sh ]
+        padlayers = [ "B.Cu" if a == back else "F.Cu" for a in at ]
+        ds = dsre.findall(text)
+        lines = numpy.array([ d[:5] for d in ds ], dtype=float).reshape(-1, 5) * scale
+        linelayers = [ silk_layers.get(int(d[5]), d[5]) for d in ds ]
+        yield (name, numbers, padlayers, pads, linelayers, lines)
+
+def have_parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+class TableWriter(object):
+    def __init__(self, basename, formats=("npz", "csv"), batch=10000):
+        self.basename = basename
+        self.formats = formats
+        self.batch = batch # Number of modules per batch
+        self.count = 0     # Number of modules added
+        self.pending = { "pads": [], "lines": [], "modules": [] }
+        self.npz = { "pads": [], "lines": [], "modules": [] } # Batches for the npz file
+        self.csv = {}
+        self.parquet = {}
+
+    def add(self, library, name, package):
+        """Add the pads and lines of a package, returns its module id"""
+        return self.add_tables(library, name, *(package.pad_table() + package.line_table()))
+
+    def add_tables(self, library, name, numbers, padlayers, pads, linelayers, lines):
+        """Add a module given as pad and line tables like Package.pad_table() and
+        Package.line_table() return them, returns its module id"""
+        module = self.count
+        self.count += 1
+        self.pending["pads"].append((module, numbers, padlayers, pads))
+        self.pending["lines"].append((module, linelayers, lines))
+        self.pending["modules"].append((module, library, name))
+        if len(self.pending["modules"]) >= self.batch:
+            self.flush()
+        return module
+
+    def columns(self):
+        """Return the pending rows of each table as a dict of column arrays"""
+        pads = self.pending["pads"]
+        lines = self.pending["lines"]
+        modules = self.pending["modules"]
+        p = numpy.concatenate([ t[3] for t in pads ]) if pads else numpy.zeros((0, 5))
+        l = numpy.concatenate([ t[2] for t in lines ]) if lines else numpy.zeros((0, 5))
+        tables = {}
+        tables["pads"] = dict(zip(pad_columns, (
+            numpy.repeat([ t[0] for t in pads ], [ len(t[3]) for t in pads ]).astype(numpy.int32),
+            numpy.array([ n for t in pads for n in t[1] ], dtype=str),
+            numpy.array([ n for t in pads for n in t[2] ], dtype=str)) +
+            tuple(p[:, i] for i in range(0, 5))))
+        tables["lines"] = dict(zip(line_columns, (
+            numpy.repeat([ t[0] for t in lines ], [ len(t[2]) for t in lines ]).astype(numpy.int32),
+            numpy.array([ n for t in lines for n in t[1] ], dtype=str)) +
+            tuple(l[:, i] for i in range(0, 5))))
+        tables["modules"] = dict(zip(module_columns, (
+            numpy.array([ t[0] for t in modules ], dtype=numpy.int32),
+            numpy.array([ t[1] for t in modules ], dtype=str),
+            numpy.array([ t[2] for t in modules ], dtype=str))))
+        return tables
+
+    def flush(self):
+        """Write the pending batch"""
+        if not self.pending["modules"]:
+            return
+        tables = self.columns()
+        for (table, names) in (("pads", pad_columns), ("lines", line_columns),
+                               ("modules", module_columns)):
+            columns = tables[table]
+            if "npz" in self.formats:
+                self.npz[table].append(columns)
+            if "csv" in self.formats:
+                self.write_csv(table, names, columns)
+            if "parquet" in self.formats:
+                self.write_parquet(table, names, columns)
+            self.pending[table] = []
+
+    def write_csv(self, table, names, columns):
+        if table not in self.csv:
+            f = open("%s-%s.csv" % (self.basename, table), "wb")
+            self.csv[table] = (f, csv.writer(f))
+            self.csv[table][1].writerow(names)
+        # Round away float noise, so values are written as short as they can be
+        values = [ columns[n].round(6).tolist() if columns[n].dtype.kind == "f" else columns[n].tolist()
+                   for n in names ]
+        self.csv[table][1].writerows(zip(*values))
+
+    def write_parquet(self, table, names, columns):
+        import pyarrow
+        import pyarrow.parquet
+
+        t = pyarrow.Table.from_arrays([ pyarrow.array(columns[n]) for n in names ], list(names))
+        if table not in self.parquet:
+            self.parquet[table] = pyarrow.parquet.ParquetWriter(
+                "%s-%s.parquet" % (self.basename, table), t.schema)
+        self.parquet[table].write_table(t)
+
+    def close(self):
+        """Write the last batch and close all files"""
+        self.flush()
+        if "npz" in self.formats:
+            arrays = {}
+            for (table, names) in (("pads", pad_columns), ("lines", line_columns),
+                                   ("modules", module_columns)):
+                for n in names:
+                    arrays["%s_%s" % (table, n)] = numpy.concatenate([ c[n] for c in self.npz[table] ]) \
+                        if self.npz[table] else numpy.zeros(0)
+            numpy.savez(self.basename + ".npz", **arrays)
+        for (f, writer) in self.csv.values():
+            f.close()
+        for writer in self.parquet.values():
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="Usage: %prog [options] [library ...]",
+                                   description="Export pad and silk line tables of footprint "
+                                   "libraries (.mod, .kicad_mod or .pretty) and generated footprints")
+    parser.add_option("-n", "--name", dest="names", action="append", default=[],
+                      help="IPC device name of a footprint to generate, may be given several times",
+                      metavar="IPCNAME")
+    parser.add_option("-o", "--outfile", dest="outfile", default="pads",
+                      help="Output file name without suffix", metavar="NAME")
+    parser.add_option("--format", dest="format",
+                      help="Comma separated output formats: npz, csv, parquet "
+                      "(default: npz, csv and parquet if pyarrow is installed)", metavar="FORMATS")
+    parser.add_option("--batch", dest="batch", type="int", default=10000,
+                      help="Number of modules to write at a time", metavar="N")
+    (options, args) = parser.parse_args()
+
+    if not args and not options.names:
+        parser.error("No libraries or names given")
+    if options.format:
+        formats = options.format.split(",")
+    else:
+        formats = [ "npz", "csv" ] + ([ "parquet" ] if have_parquet() else [])
+    for format in formats:
+        if format not in ("npz", "csv", "parquet"):
+            parser.error("Unsupported output format %s" % format)
+    if "parquet" in formats and not have_parquet():
+        parser.error("Parquet output needs pyarrow")
+
+    writer = TableWriter(options.outfile, formats, options.batch)
+    for name in options.names:
+        generator = footprinter.make_generator(name)
+        if generator is None:
+            parser.error("Unsupported package type %s" % name)
+        generator.parse_ipc_name(name)
+        writer.add("", name, generator.stream())
+    for path in args:
+        library = os.path.split(path.rstrip("/"))[1]
+        if os.path.isdir(path) or modfile.kicad_mod_name(path) is not None:
+            for (name, package) in modfile.read_library(path):
+                writer.add(library, name, package)
+        else:
+            for tables in mod_tables(path):
+                writer.add_tables(library, *tables)
+    writer.close()
+    print("%d modules exported" % writer.count)
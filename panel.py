@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# Build panels and solder test coupons with many footprint instances.
+#
+# Each distinct footprint is generated and placed once, and instances only refer to it
+# by footprint id together with a position and rotation. Courtyard overlaps are found
+# with a grid index over the instance bounding boxes, and the output is streamed one
+# instance at a time, reusing the serialized footprint for each rotation.
+#
+# Back side variants are separate footprints (generate, then Package.mirror()).
+#
+# Example, a coupon with 100 each of two packages:
+#   -n QFP50P900X900-48 -n SOIC127P600-8 --count 100 --outfile coupon.kicad_pcb
+#
+
+import optparse
+import time
+import numpy
+import common
+import footprinter
+
+class Panel(object):
+    def __init__(self):
+        self.footprints = [] # Shared, placed geometry of each distinct footprint
+        self.names = []      # Footprint names, indexed by footprint id
+        self.ids = {}        # Footprint id by name
+        # Instance records, one entry per instance in each list
+        self.fpid = []
+        self.x = []
+        self.y = []
+        self.rotation = []
+
+    def add_footprint(self, name, package):
+        """Add a footprint and return its id. Adding the same name again returns the
+        id of the existing footprint."""
+        if name in self.ids:
+            return self.ids[name]
+        fpid = len(self.footprints)
+        self.footprints.append(package.placed())
+        self.names.append(name)
+        self.ids[name] = fpid
+        return fpid
+
+    def place(self, fpid, x, y, rotation=0):
+        """Place an instance of a footprint, returns the instance number"""
+        self.fpid.append(fpid)
+        self.x.append(x)
+        self.y.append(y)
+        self.rotation.append(rotation)
+        return len(self.fpid) - 1
+
+    def place_grid(self, fpid, columns, rows, pitchx, pitchy, x0=0, y0=0, rotation=0):
+        """Place columns*rows instances on a grid with the first one at (x0, y0)"""
+        (gx, gy) = numpy.meshgrid(x0 + numpy.arange(columns) * pitchx,
+                                  y0 + numpy.arange(rows) * pitchy)
+        n = columns * rows
+        self.fpid.extend([fpid] * n)
+        self.x.extend(gx.ravel().tolist())
+        self.y.extend(gy.ravel().tolist())
+        self.rotation.extend([rotation] * n)
+
+    def __len__(self):
+        return len(self.fpid)
+
+    def courtyards(self):
+        """Return an array with one (x0, y0, x1, y1) row per instance"""
+        fpid = numpy.asarray(self.fpid, dtype=int)
+        rotation = numpy.asarray(self.rotation, dtype=float)
+        boxes = numpy.zeros((len(fpid), 4))
+        # Rotated courtyards are computed once per footprint and rotation
+        for (f, r) in set(zip(self.fpid, self.rotation)):
+            box = common.transform_box(self.footprints[f].courtyard,
+                                       common.Transform().rotated(r) if r else None)
+            boxes[(fpid == f) & (rotation == r)] = (box[0][0], box[0][1], box[1][0], box[1][1])
+        x = numpy.asarray(self.x, dtype=float)
+        y = numpy.asarray(self.y, dtype=float)
+        boxes[:, 0] += x
+        boxes[:, 2] += x
+        boxes[:, 1] += y
+        boxes[:, 3] += y
+        return boxes
+
+    def overlaps(self):
+        """Return a sorted list of (i, j) instance pairs with overlapping courtyards.
+        Courtyards that only touch do not overlap."""
+        boxes = self.courtyards()
+        if len(boxes) == 0:
+            return []
+        # Grid cells as large as the largest courtyard, so that each courtyard is in
+        # at most four cells and only instances sharing a cell need to be compared
+        cell = max(float((boxes[:, 2] - boxes[:, 0]).max()),
+                   float((boxes[:, 3] - boxes[:, 1]).max()), 1e-6)
+        cells = numpy.floor(boxes / cell).astype(int).tolist()
+        grid = {}
+        for (i, (cx0, cy0, cx1, cy1)) in enumerate(cells):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    grid.setdefault((cx, cy), []).append(i)
+
+        b = boxes.tolist()
+        pairs = set()
+        for members in grid.values():
+            for (n, i) in enumerate(members):
+                for j in members[n + 1:]:
+                    if (b[i][0] < b[j][2] and b[j][0] < b[i][2] and
+                        b[i][1] < b[j][3] and b[j][1] < b[i][3]):
+                        pairs.add((i, j))
+        return sorted(pairs)
+
+    def instance(self, fpid, transform):
+        """Return a package with the shared data of a footprint and transform on top.
+        The shared footprint itself is never modified."""
+        shared = self.footprints[fpid]
+        package = common.Package()
+        package.data = shared.data
+        package.bbox = shared.bbox
+        package.transform = transform
+        return package
+
+    def body(self, fpid, rotation):
+        """Return the module contents of a footprint for an instance rotation. Board
+        files store pad orientations including the module rotation."""
+        package = self.footprints[fpid]
+        if rotation:
+            package = self.instance(fpid, common.Transform(angle=rotation)).placed()
+        return "".join(d.kicad_sexp() for d in package.data)
+
+    def write_kicad_pcb(self, f):
+        """Write the panel as a kicad board file, one module per instance"""
+        f.write("(kicad_pcb (version 4) (host footprinter 0)\n")
+        f.write("  (general (thickness 1.6) (drawings 0) (tracks 0) (zones 0) (modules %d) (nets 1))\n" % len(self))
+        f.write("  (page User %d %d)\n" % self.page_size())
+        f.write("  (layers\n")
+        for layer in ("0 F.Cu signal", "31 B.Cu signal", "34 B.Paste user", "35 F.Paste user",
+                      "36 B.SilkS user", "37 F.SilkS user", "38 B.Mask user", "39 F.Mask user",
+                      "44 Edge.Cuts user"):
+            f.write("    (%s)\n" % layer)
+        f.write("  )\n")
+        f.write("  (net 0 \"\")\n")
+
+        bodies = {}
+        sides = [ package.side() for package in self.footprints ]
+        tedit = int(time.time())
+        for (i, (fpid, x, y, rotation)) in enumerate(zip(self.fpid, self.x, self.y, self.rotation)):
+            key = (fpid, rotation)
+            if key not in bodies:
+                bodies[key] = self.body(fpid, rotation)
+            if rotation:
+                at = "%.3f %.3f %g" % (x, y, rotation)
+            else:
+                at = "%.3f %.3f" % (x, y)
+            # Back side instances have their texts on the back silkscreen, mirrored
+            side = sides[fpid]
+            f.write("  (module %s (layer %s.Cu) (tedit %X) (at %s)\n" % (self.names[fpid], side, tedit, at))
+            mirror = " (justify mirror)" if side == "B" else ""
+            f.write("    (fp_text reference U%d (at 0 -1 %g) (layer %s.SilkS)\n" % (i + 1, rotation, side))
+            f.write("      (effects (font (size 1.5 1.5) (thickness 0.15))%s))\n" % mirror)
+            f.write("    (fp_text value %s (at 0 1 %g) (layer %s.SilkS) hide\n" % (self.names[fpid], rotation, side))
+            f.write("      (effects (font (size 1.5 1.5) (thickness 0.15))%s))\n" % mirror)
+            f.write(bodies[key])
+            f.write("  )\n")
+        f.write(")\n")
+
+    def write_kicad_mod(self, f, name):
+        """Write the whole panel as one footprint with the geometry of all instances"""
+        f.write("(module %s (layer F.Cu) (tedit %X)\n" % (name, int(time.time())))
+        f.write("  (at 0 0)\n")
+        f.write("  (descr \"Panel with %d footprints\")\n" % len(self))
+        for (fpid, x, y, rotation) in zip(self.fpid, self.x, self.y, self.rotation):
+            package = self.instance(fpid, common.Transform().rotated(rotation).translated(x, y))
+            f.write("".join(d.kicad_sexp() for d in package.placed().data))
+        f.write(")\n")
+
+    def page_size(self):
+        """Return the (width, height) in whole mm needed to hold all courtyards"""
+        boxes = self.courtyards()
+        if len(boxes) == 0:
+            return (10, 10)
+        return (int(numpy.ceil(boxes[:, 2].max())) + 10, int(numpy.ceil(boxes[:, 3].max())) + 10)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="Usage: %prog [options]",
+                                   description="Build a test coupon with a grid of footprints")
+    parser.add_option("-n", "--name", dest="names", action="append", default=[],
+                      help="IPC device name, may be given several times", metavar="IPCNAME")
+    parser.add_option("--count", dest="count", type="int", default=1,
+                      help="Number of instances of each footprint", metavar="N")
+    parser.add_option("--columns", dest="columns", type="int", default=10,
+                      help="Number of instances in each row", metavar="N")
+    parser.add_option("--gap", dest="gap", type="float", default=1.0,
+                      help="Space between courtyards [mm]", metavar="N")
+    parser.add_option("--rotate", dest="rotate", type="float", default=0,
+                      help="Rotate every other instance by this much [degrees]", metavar="N")
+    parser.add_option("--format", dest="format", default="kicad_pcb",
+                      help="Output file format: kicad_pcb (board with one module per "
+                      "instance) or kicad_mod (single footprint)", metavar="FORMAT")
+    parser.add_option("--outfile", dest="outfile", default="panel.kicad_pcb",
+                      help="Output file name", metavar="FILE")
+    (options, args) = parser.parse_args()
+
+    if not options.names:
+        parser.error("-n argument is mandatory")
+
+    panel = Panel()
+    y = 0.0
+    for name in options.names:
+        generator = footprinter.make_generator(name)
+        if generator is None:
+            parser.error("Unsupported package type %s" % name)
+        generator.parse_ipc_name(name)
+        package = generator.generate()
+        fpid = panel.add_footprint(name, package)
+
+        # Square pitch fitting the courtyard at any multiple of 90 degrees
+        c = package.courtyard
+        pitch = max(c[1][0] - c[0][0], c[1][1] - c[0][1]) + options.gap
+        for i in range(0, options.count):
+            (row, col) = divmod(i, options.columns)
+            panel.place(fpid, col * pitch - c[0][0], y + row * pitch - c[0][1],
+                        options.rotate if i % 2 else 0)
+        y += ((options.count + options.columns - 1) // options.columns) * pitch
+
+    overlaps = panel.overlaps()
+    if overlaps:
+        print("Warning: %d overlapping courtyards, first between instances %d and %d" % (
+            len(overlaps), overlaps[0][0] + 1, overlaps[0][1] + 1))
+
+    f = open(options.outfile, "w")
+    if options.format == "kicad_pcb":
+        panel.write_kicad_pcb(f)
+    elif options.format == "kicad_mod":
+        panel.write_kicad_mod(f, "PANEL")
+    else:
+        parser.error("Unsupported output format")
+    f.close()
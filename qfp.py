@@ -3,7 +3,8 @@
 # This package type is standardised in JEDEC MS-026.
 #
 import re
-from common import Package, Line, Pad, Rectangle
+import copy
+from common import PackageStream, Line, Pad, Rectangle, Transform, batch_size
 
 class Params(object):
     pass
@@ -94,44 +95,66 @@ class Qfp(object):
                 self.params.termwidth = 0.50
 
     
-    def generate(self, **kwargs):
-        """Generate data using previously loaded name and parameters. Returns a list."""
-        data = []
+    def courtyard(self):
+        """Return the courtyard ((x0, y0), (x1, y1))"""
         params = self.params
-        package = Package()
+        courtyardsize = params.l1 / 2 + params.JT + params.courtyard_excess
+        return ((-courtyardsize, -courtyardsize), (courtyardsize, courtyardsize))
 
+    def stream(self, skeleton=None):
+        """Return a PackageStream that generates the data when it is read. skeleton is
+        from skeleton(), it is made when the data is generated if not given. The
+        stream uses a copy of the parameters, so the data matches the courtyard even
+        if the parameters are changed later."""
+        generator = copy.copy(self)
+        generator.params = params = copy.copy(self.params)
+        package = PackageStream(lambda: generator.batches(skeleton))
         package.description = "QFP-%d, %.02fmm pitch" % (
                                                     params.pincount, params.pitch)
-    
-        l = params.l1 # Package length along this dimension (FIXME: non-square packages)
-        # Positions of things relative to data center
-        padtoe = l / 2 + params.JT
-        padheel = l / 2 - params.footlen - params.JH
-        padlen = padtoe - padheel
-        padcenter = padtoe - padlen / 2.0
-        padwidth = params.termwidth + params.JS
+        package.courtyard = generator.courtyard()
+        return package
+
+    def generate(self, **kwargs):
+        """Generate data using previously loaded name and parameters. Returns a package."""
+        return self.stream().package()
+
+    def variants(self, densities="LNM"):
+        """Return a PackageStream for each density level in densities. The package body
+        and pin layout don't depend on the density, so they are generated once and
+        shared by all of the packages."""
+        skeleton = self.skeleton()
+        streams = []
+        for density in densities:
+            variant = copy.copy(self)
+            variant.params = copy.copy(self.params)
+            variant.set_density(density)
+            streams.append(variant.stream(skeleton))
+        return streams
+
+    def skeleton(self):
+        """Return the parts of the package that don't depend on the density level:
+        (batches of package layer primitives for the body, [(pin number, y,
+        transform)])"""
+        params = self.params
+        l = params.l1
         pins_per_side = params.pincount // 4
         first_pad_y = (pins_per_side - 1) * params.pitch / 2.0
-        courtyardsize = padtoe + params.courtyard_excess
-        outlinesize = l / 2 - params.termlen + params.silkwidth/2.0
-
-        # Draw courtyard on package layer
-        rect = Rectangle( (-courtyardsize, -courtyardsize), (courtyardsize, courtyardsize))
-        rect.layer = "package"
-        data.append(rect)
 
         # Draw package size on package layer
+        body = []
         for side in range(0, 4):
+            data = []
             chamfer = 0.5
             packagesize = l / 2 - params.termlen
             th = (270 + side * 90) % 360 # Coordinate system rotation for this side
+            t = Transform().rotated(th)
             line = Line( (-packagesize + chamfer, packagesize), (packagesize - chamfer, packagesize) )
             line.layer = "package"
-            line.rotate(th)
+            line.transform = t
             data.append(line)
             line = Line( (packagesize - chamfer, packagesize), (packagesize, packagesize - chamfer) )
             line.layer = "package"
-            line.rotate(th)
+            line.transform = t
             data.append(line)
 
             leadblockw = pins_per_side * params.pitch / 2.0
@@ -139,24 +162,65 @@ class Qfp(object):
             
             rect = Rectangle( (-leadblockw, leadblockh), (leadblockw, leadblockh - params.footlen), 0)
             rect.layer = "package"
-            rect.rotate(th)
+            rect.transform = t
             data.append(rect)
             rect = Rectangle( (-leadblockw, leadblockh - params.footlen), (leadblockw, packagesize), 0)
             rect.layer = "package"
-            rect.rotate(th)
+            rect.transform = t
             data.append(rect)
+            body.append(data)
+
+        # Pin 1 is in the lower-left (negative X, positive Y) corner
+        # Pads are drawn on the 0-degree (right) side and rotated into place
+        pins = []
+        pinno = 1
+        for side in range(0, 4):
+            th = (270 + side * 90) % 360 # Coordinate system rotation for this side
+            t = Transform().rotated(th)
+            y = first_pad_y
+            for pin in range(0, pins_per_side):
+                pins.append((pinno, y, t))
+                pinno += 1
+                y -= params.pitch
+        return (body, pins)
+
+    def batches(self, skeleton=None):
+        """Generate the data as lists of primitives, with at most batch_size pads each"""
+        params = self.params
+        (body, pins) = skeleton or self.skeleton()
+    
+        l = params.l1 # Package length along this dimension (FIXME: non-square packages)
+        # Positions of things relative to data center
+        padtoe = l / 2 + params.JT
+        padheel = l / 2 - params.footlen - params.JH
+        padlen = padtoe - padheel
+        padcenter = padtoe - padlen / 2.0
+        padwidth = params.termwidth + params.JS
+        pins_per_side = params.pincount // 4
+        first_pad_y = (pins_per_side - 1) * params.pitch / 2.0
+        outlinesize = l / 2 - params.termlen + params.silkwidth/2.0
+
+        # Draw courtyard on package layer
+        rect = Rectangle(*self.courtyard())
+        rect.layer = "package"
+        yield [ rect ]
+
+        for data in body:
+            yield list(data)
     
         # Draw outline on silkscreen
+        data = []
         linelen = outlinesize - first_pad_y - padwidth / 2 - params.silkwidth * 1.5
         for side in range(0, 4):
             th = (270 + side * 90) % 360 # Coordinate system rotation for this side
+            t = Transform().rotated(th)
             line = Line( (-outlinesize, outlinesize), (-outlinesize + linelen, outlinesize) )
             line.width = params.silkwidth
-            line.rotate(th)
+            line.transform = t
             data.append(line)
             line = Line( (-outlinesize, outlinesize), (-outlinesize, outlinesize - linelen) )
             line.width = params.silkwidth
-            line.rotate(th)
+            line.transform = t
             data.append(line)
 
         # Draw orientation mark on silkscreen
@@ -164,33 +228,21 @@ class Qfp(object):
         line = Line( (-outlinesize, outlinesize), (-outlinesize - marklen, outlinesize + marklen) )
         line.width = params.silkwidth
         data.append(line)
+        yield data
     
-        # Add pads, starting with pin 1 in lower-left (negative X, positive Y) corner
-        # Pads are drawn on the 0-degree (right) side and rotated into place
-        pinno = 1
-        for side in range(0, 4):
-            th = (270 + side * 90) % 360 # Coordinate system rotation for this side
-    
-            # Pad center coordinates
-            x = padcenter
-            y = first_pad_y
-    
-            for pin in range(0, pins_per_side):
-                pad = Pad(pinno)
-                pad.x = x
-                pad.y = y
-                pad.ysize = padwidth
-                pad.xsize = padlen
-                pad.rotate(th)
-    
-                data.append(pad)
-    
-                pinno += 1
-                y -= params.pitch
+        # Add pads at the pin positions of the skeleton
+        data = []
+        for (pinno, y, t) in pins:
+            pad = Pad(pinno)
+            pad.x = padcenter
+            pad.y = y
+            pad.ysize = padwidth
+            pad.xsize = padlen
+            pad.transform = t
 
-        # All done!
-        package.data = data
-        package.courtyard = ((-courtyardsize, -courtyardsize), (courtyardsize, courtyardsize))
-    
-        return package
-    
\ No newline at end of file
+            data.append(pad)
+            if len(data) == batch_size:
+                yield data
+                data = []
+        if data:
+            yield data
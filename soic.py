@@ -8,7 +8,8 @@
 #  TSSOP: JEDEC MO-153 - 4.4mm body, 0.65mm pitch 
 #
 import re
-from common import Package, Line, Pad, Rectangle
+import copy
+from common import PackageStream, Line, Pad, Rectangle, Transform, batch_size
 
 class Params(object):
     pass
@@ -97,83 +98,132 @@ class Soic(object):
                 self.params.termwidth = 0.51 # 1.27 pitch, from MS-012F
 
     
-    def generate(self, **kwargs):
-        """Generate data using previously loaded name and parameters. Returns a list."""
-        data = []
+    def courtyard(self):
+        """Return the courtyard ((x0, y0), (x1, y1))"""
         params = self.params
-        package = Package()
+        pins_per_side = params.pincount // 2
+        packagew = ((pins_per_side - 1) * params.pitch + 1.0) / 2.0 # About right, for small chips
+        courtyardw = packagew + params.courtyard_excess
+        courtyardh = params.l / 2 + params.JT + params.courtyard_excess
+        return ((-courtyardw, -courtyardh), (courtyardw, courtyardh))
 
+    def stream(self, skeleton=None):
+        """Return a PackageStream that generates the data when it is read. skeleton is
+        from skeleton(), it is made when the data is generated if not given. The
+        stream uses a copy of the parameters, so the data matches the courtyard even
+        if the parameters are changed later."""
+        generator = copy.copy(self)
+        generator.params = params = copy.copy(self.params)
+        package = PackageStream(lambda: generator.batches(skeleton))
         body = params.l - 2*params.termlen
         package.description = "SOP-%d, %.02fmm pitch, %.2f mm body" % (
                                                     params.pincount, params.pitch, body)
-    
-        l = params.l # Package lead span
-        # Positions and sizes of things relative to data center
-        padtoe = l / 2 + params.JT
-        padheel = l / 2 - params.footlen - params.JH
-        padlen = padtoe - padheel
-        padcenter = padtoe - padlen / 2.0
-        padwidth = params.termwidth + params.JS
+        package.courtyard = generator.courtyard()
+        return package
+
+    def generate(self, **kwargs):
+        """Generate data using previously loaded name and parameters. Returns a package."""
+        return self.stream().package()
+
+    def variants(self, densities="LNM"):
+        """Return a PackageStream for each density level in densities. The package body
+        and pin layout don't depend on the density, so they are generated once and
+        shared by all of the packages."""
+        skeleton = self.skeleton()
+        streams = []
+        for density in densities:
+            variant = copy.copy(self)
+            variant.params = copy.copy(self.params)
+            variant.set_density(density)
+            streams.append(variant.stream(skeleton))
+        return streams
+
+    def skeleton(self):
+        """Return the parts of the package that don't depend on the density level:
+        ([package size and silkscreen outline primitives], [(pin number, x,
+        transform)])"""
+        params = self.params
+        l = params.l
         pins_per_side = params.pincount // 2
         first_pad_x = - (pins_per_side - 1) * params.pitch / 2.0
         packagew = ((pins_per_side - 1) * params.pitch + 1.0) / 2.0 # About right, for small chips
         packageh = l / 2 - params.termlen
-        courtyardw = packagew + params.courtyard_excess
-        courtyardh = padtoe + params.courtyard_excess
         outlinew = packagew + params.silkwidth/2.0
         outlineh = packageh + params.silkwidth/2.0
-
-        # Draw courtyard on package layer
-        rect = Rectangle( (-courtyardw, -courtyardh), (courtyardw, courtyardh))
-        rect.layer = "package"
-        data.append(rect)
+        body = []
 
         # Draw package size on package layer
         rect = Rectangle( (-packagew, -packageh), (packagew, packageh))
         rect.layer = "package"
-        data.append(rect)
+        body.append(rect)
         
         # Draw outline on silkscreen
         rect = Rectangle( (-outlinew, -outlineh), (outlinew, outlineh))
         rect.width = params.silkwidth
-        data.append(rect)
+        body.append(rect)
         marksize = 0.75
         rect = Rectangle( (-outlinew, -marksize), (-outlinew + marksize, marksize))
         rect.width = params.silkwidth
-        data.append(rect)
-        
-        # Draw orientation marker by pin 1 on silkscreen
-        markx = first_pad_x - padwidth / 2.0 - params.silkwidth * 2
-        line = Line( (markx, padcenter - params.silkwidth*2), (markx, padcenter))
-        line.width = params.silkwidth
-        data.append(line)
+        body.append(rect)
 
-        # Add pads, starting with pin 1 in lower-left (negative X, positive Y) corner
+        # Pin 1 is in the lower-left (negative X, positive Y) corner
         # Pads are drawn on the bottom side and rotated into place
+        pins = []
         pinno = 1
         for side in range(0, 2):
             th = side * 180 # Coordinate system rotation for this side
-    
-            # Pad center coordinates
+            t = Transform().rotated(th)
             x = first_pad_x
-            y = padcenter
-    
             for pin in range(0, pins_per_side):
-                pad = Pad(pinno)
-                pad.x = x
-                pad.y = y
-                pad.ysize = padlen
-                pad.xsize = padwidth
-                pad.rotate(th)
-    
-                data.append(pad)
-    
+                pins.append((pinno, x, t))
                 pinno += 1
                 x += params.pitch
+        return (body, pins)
 
-        # All done!
-        package.data = data
-        package.courtyard = ((-courtyardw, -courtyardh), (courtyardw, courtyardh))
+    def batches(self, skeleton=None):
+        """Generate the data as lists of primitives, with at most batch_size pads each"""
+        data = []
+        params = self.params
+        (body, pins) = skeleton or self.skeleton()
     
-        return package
-    
\ No newline at end of file
+        l = params.l # Package lead span
+        # Positions and sizes of things relative to data center
+        padtoe = l / 2 + params.JT
+        padheel = l / 2 - params.footlen - params.JH
+        padlen = padtoe - padheel
+        padcenter = padtoe - padlen / 2.0
+        padwidth = params.termwidth + params.JS
+        pins_per_side = params.pincount // 2
+        first_pad_x = - (pins_per_side - 1) * params.pitch / 2.0
+
+        # Draw courtyard on package layer
+        rect = Rectangle(*self.courtyard())
+        rect.layer = "package"
+        data.append(rect)
+
+        # Package size and outline from the skeleton
+        data.extend(body)
+        
+        # Draw orientation marker by pin 1 on silkscreen
+        markx = first_pad_x - padwidth / 2.0 - params.silkwidth * 2
+        line = Line( (markx, padcenter - params.silkwidth*2), (markx, padcenter))
+        line.width = params.silkwidth
+        data.append(line)
+        yield data
+
+        # Add pads at the pin positions of the skeleton
+        data = []
+        for (pinno, x, t) in pins:
+            pad = Pad(pinno)
+            pad.x = x
+            pad.y = padcenter
+            pad.ysize = padlen
+            pad.xsize = padwidth
+            pad.transform = t
+
+            data.append(pad)
+            if len(data) == batch_size:
+                yield data
+                data = []
+        if data:
+            yield data
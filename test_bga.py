@@ -0,0 +1,104 @@
+# Tests for BGA ball naming, depopulation and name parsing.
+#
+# Run with:
+#   python -m unittest test_bga
+#
+
+import unittest
+
+import numpy
+from common import PadArray
+from bga import Bga, row_name, row_letters
+
+def bga(name):
+    generator = Bga()
+    generator.parse_ipc_name(name)
+    return generator
+
+def balls(package):
+    """Return {ball name: (x, y)} of a generated package"""
+    r = {}
+    for d in package.placed().data:
+        if isinstance(d, PadArray):
+            for (name, x, y) in zip(d.names, d.xlist(), d.ylist()):
+                r[str(name)] = (x, y)
+    return r
+
+class RowNameTest(unittest.TestCase):
+    def test_letters(self):
+        for letter in "IOQSXZ":
+            self.assertFalse(letter in row_letters)
+        self.assertEqual([ row_name(r) for r in range(0, 4) ], ["A", "B", "C", "D"])
+        self.assertEqual(row_name(7), "H")
+        self.assertEqual(row_name(8), "J")
+        self.assertEqual(row_name(19), "Y")
+
+    def test_two_letters(self):
+        self.assertEqual(row_name(20), "AA")
+        self.assertEqual(row_name(21), "AB")
+        self.assertEqual(row_name(39), "AY")
+        self.assertEqual(row_name(40), "BA")
+        self.assertEqual(row_name(20 + 20 * 20), "AAA")
+
+class BallTest(unittest.TestCase):
+    def test_parse(self):
+        p = bga("BGA256C100P16X16_1700X1700X160M").params
+        self.assertEqual((p.pincount, p.collapsing, p.pitch, p.cols, p.rows, p.l1, p.l2, p.density),
+                         (256, True, 1.0, 16, 16, 17.0, 17.0, "M"))
+        self.assertFalse(bga("BGA100N50P10X10_600X600").params.collapsing)
+
+    def test_full_grid(self):
+        b = balls(bga("BGA256C100P16X16_1700X1700N").generate())
+        self.assertEqual(len(b), 256)
+        # A1 is in the upper left corner, rows go down and columns right
+        self.assertEqual(b["A1"], (-7.5, -7.5))
+        self.assertEqual(b["A16"], (7.5, -7.5))
+        self.assertEqual(b["T1"], (-7.5, 7.5))
+        self.assertFalse("I1" in b)
+
+    def test_names(self):
+        names = bga("BGA484C100P22X22_2300X2300N").ball_names()
+        self.assertEqual(names.shape, (22, 22))
+        self.assertEqual(names[0][0], "A1")
+        self.assertEqual(names[19][21], "Y22")
+        self.assertEqual(names[21][0], "AB1")
+
+    def test_centered_void(self):
+        g = bga("BGA192C80P14X14_1200X1200N")
+        mask = g.ball_mask()
+        self.assertEqual(mask.sum(), 192)
+        self.assertFalse(mask[6:8, 6:8].any())
+        b = balls(g.generate())
+        self.assertEqual(len(b), 192)
+        self.assertFalse("G7" in b)
+        self.assertTrue("E5" in b)
+
+    def test_unguessable_void(self):
+        g = bga("BGA250C100P16X16_1700X1700N")
+        self.assertRaises(ValueError, g.ball_mask)
+
+    def test_depopulated_names(self):
+        g = bga("BGA98C100P10X10_1100X1100N")
+        g.params.depopulated = ["A1", "K10"]
+        b = balls(g.generate())
+        self.assertEqual(len(b), 98)
+        self.assertFalse("A1" in b or "K10" in b)
+        self.assertTrue("A2" in b)
+
+    def test_depopulated_mask(self):
+        g = bga("BGA50C100P10X10_1100X1100N")
+        mask = numpy.zeros((10, 10), dtype=bool)
+        mask[::2] = True
+        g.params.depopulated = mask
+        b = balls(g.generate())
+        self.assertEqual(len(b), 50)
+        self.assertEqual(set(name[0] for name in b), set("ACEGJ"))
+
+    def test_count_mismatch(self):
+        g = bga("BGA99C100P10X10_1100X1100N")
+        g.params.depopulated = ["A1", "A2"]
+        self.assertRaises(ValueError, g.generate)
+
+
+if __name__ == "__main__":
+    unittest.main()
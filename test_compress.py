@@ -0,0 +1,120 @@
+# Tests for compressed libraries and output files.
+#
+# Run with:
+#   python -m unittest test_compress
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import common
+import footprinter
+import modfile
+from qfp import Qfp
+from soic import Soic
+
+def library_text(names):
+    """Return the text of a legacy library with the named packages, and the offsets
+    of their $MODULE lines"""
+    f = StringIO()
+    f.write("PCBNEW-LibModule-V1  T\n$INDEX\n%s\n$EndINDEX\n" % "\n".join(names))
+    offsets = []
+    for name in names:
+        generator = Qfp() if name.startswith("QFP") else Soic()
+        generator.parse_ipc_name(name)
+        offsets.append(f.tell())
+        footprinter.make_emp(f, name, generator.generate(), False)
+    f.write("$EndLIBRARY\n")
+    return (f.getvalue(), offsets)
+
+class OutputFilenameTest(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual(footprinter.output_filename("out.x", "kicad_mod"), "out.kicad_mod")
+        self.assertEqual(footprinter.output_filename("out", "png"), "out.png")
+
+    def test_compressed(self):
+        self.assertEqual(footprinter.output_filename("out", "kicad_mod", "gzip"), "out.kicad_mod.gz")
+        self.assertEqual(footprinter.output_filename("out", "emp", "zstd"), "out.emp.zst")
+        # Images are not compressed
+        self.assertEqual(footprinter.output_filename("out", "tiled-png", "gzip"), "out-tiled.png")
+
+class CompressedLibraryTest(unittest.TestCase):
+    names = ["QFP50P900X900-48N", "SOIC127P600-8N"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        (self.text, self.offsets) = library_text(self.names)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, compression):
+        filename = os.path.join(self.directory, "lib.mod" + common.compression_suffix[compression])
+        f = common.open_library(filename, "w", compression)
+        f.write(self.text)
+        f.close()
+        return filename
+
+    def round_trip(self, compression):
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                self.skipTest("needs zstandard")
+        filename = self.write(compression)
+        f = common.open_library(filename)
+        lines = list(f)
+        f.close()
+        self.assertTrue(all(isinstance(l, str) for l in lines))
+        self.assertEqual("".join(lines), self.text)
+
+        mod = modfile.Mod(filename)
+        mod.parse()
+        mod.f.close()
+        self.assertEqual(mod.names, self.names)
+        plain = modfile.Mod(self.write(None))
+        plain.parse()
+        plain.f.close()
+        for (a, b) in zip(mod.mods, plain.mods):
+            self.assertEqual(a.pad_table()[0], b.pad_table()[0])
+            self.assertEqual(a.pad_table()[2].tolist(), b.pad_table()[2].tolist())
+
+        # Modules are found by their offset in the uncompressed text
+        for (name, offset) in zip(self.names, self.offsets):
+            mod = modfile.Mod(filename)
+            package = mod.parse_at(offset)
+            mod.f.close()
+            self.assertEqual(mod.names, [name])
+            self.assertEqual(len(package.pad_table()[0]), int(name.split("-")[1][:-1]))
+
+    def test_plain(self):
+        self.round_trip(None)
+
+    def test_gzip(self):
+        self.round_trip("gzip")
+
+    def test_zstd(self):
+        self.round_trip("zstd")
+
+    def test_write_module(self):
+        """make_emp writes straight into a compressed library"""
+        filename = os.path.join(self.directory, "one.mod.gz")
+        f = common.open_library(filename, "w", "gzip")
+        generator = Soic()
+        generator.parse_ipc_name("SOIC127P600-8N")
+        footprinter.make_emp(f, "SOIC127P600-8N", generator.generate())
+        f.close()
+        mod = modfile.Mod(filename)
+        mod.parse()
+        mod.f.close()
+        self.assertEqual(mod.names, ["SOIC127P600-8N"])
+
+
+if __name__ == "__main__":
+    unittest.main()
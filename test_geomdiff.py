@@ -0,0 +1,131 @@
+# Tests for comparing footprint geometry: matching pads, silk lines and modules.
+#
+# Run with:
+#   python -m unittest test_geomdiff
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import common
+import footprinter
+from geomdiff import strip_density, unique_keys, line_distances, diff_packages, diff_libraries
+from qfp import Qfp
+from soic import Soic
+
+def generate(name):
+    generator = Qfp() if name.startswith("QFP") else Soic()
+    generator.parse_ipc_name(name)
+    return generator.generate()
+
+class MatchTest(unittest.TestCase):
+    def test_strip_density(self):
+        self.assertEqual(strip_density("QFP50P900X900-48N"), "QFP50P900X900-48")
+        self.assertEqual(strip_density("SOIC127P600-8L"), "SOIC127P600-8")
+        self.assertEqual(strip_density("SOIC127P600-8"), "SOIC127P600-8")
+        # Only a density letter right after the pin count
+        self.assertEqual(strip_density("TSSOP-PAN"), "TSSOP-PAN")
+
+    def test_unique_keys(self):
+        self.assertEqual(unique_keys(["1", "2"]).tolist(), ["1", "2"])
+        self.assertEqual(unique_keys(["1", "", "", "2"]).tolist(), ["1#1", "#1", "#2", "2#1"])
+
+    def test_line_distances(self):
+        a = numpy.array([ [0, 0, 1, 0, 0.15], [0, 1, 1, 1, 0.15] ])
+        b = numpy.array([ [1, 0, 0, 0, 0.15], [0, 1.5, 1, 1.5, 0.15] ])
+        d = line_distances(a, b)
+        # Endpoints in either order
+        self.assertEqual(d[0][0], 0)
+        self.assertAlmostEqual(d[1][1], 0.5)
+        self.assertAlmostEqual(d[0][1], 1.5)
+
+class DiffPackagesTest(unittest.TestCase):
+    def test_same(self):
+        self.assertFalse(diff_packages(generate("QFP50P900X900-48N"), generate("QFP50P900X900-48N")))
+
+    def test_rotated(self):
+        package = generate("SOIC127P600-8N")
+        package.rotate(90)
+        diff = diff_packages(generate("SOIC127P600-8N"), package)
+        self.assertEqual(len(diff.pads), 8)
+        self.assertTrue(all(d[5] == 90 for d in diff.pads))
+        self.assertTrue(len(diff.silk_moved) > 0)
+
+    def test_density(self):
+        diff = diff_packages(generate("QFP50P900X900-48L"), generate("QFP50P900X900-48M"))
+        self.assertEqual(len(diff.pads), 48)
+        self.assertEqual((diff.pads_added, diff.pads_removed), ([], []))
+        # The courtyard grows on every side
+        self.assertTrue(all(g > 0 for g in diff.courtyard))
+        self.assertEqual(diff_packages(generate("QFP50P900X900-48L"), generate("QFP50P900X900-48M"),
+                                       tolerance=10).pads, [])
+
+    def test_pads_added(self):
+        old = generate("SOIC127P600-8N")
+        new = generate("SOIC127P600-8N")
+        new.data = [ d for d in new.data if not (isinstance(d, common.Pad) and d.number in (3, 4)) ]
+        diff = diff_packages(old, new)
+        self.assertEqual(diff.pads_removed, ["3", "4"])
+        self.assertEqual(diff_packages(new, old).pads_added, ["3", "4"])
+        self.assertEqual(diff.pads, [])
+
+class DiffLibrariesTest(unittest.TestCase):
+    names = ["QFP50P900X900-48", "SOIC127P600-8"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def mod(self, density, names=None):
+        filename = os.path.join(self.directory, "lib-%s.mod" % density)
+        f = open(filename, "w")
+        f.write("PCBNEW-LibModule-V1  T\n")
+        for name in names or self.names:
+            footprinter.make_emp(f, name + density, generate(name + density), False)
+        f.write("$EndLIBRARY\n")
+        f.close()
+        return filename
+
+    def pretty(self, density, compress=None):
+        directory = os.path.join(self.directory, "lib-%s.pretty" % density)
+        os.mkdir(directory)
+        for name in self.names:
+            filename = os.path.join(directory, name + density + ".kicad_mod" +
+                                    common.compression_suffix[compress])
+            footprinter.write_format("kicad_mod", filename, name + density,
+                                     generate(name + density), compress=compress)
+        return directory
+
+    def test_by_name(self):
+        self.assertEqual(diff_libraries(self.mod("N"), self.mod("N")), [])
+        diffs = diff_libraries(self.mod("L"), self.mod("N"))
+        self.assertEqual([ (d.name, d.status) for d in diffs ],
+                         [ ("QFP50P900X900-48N", "added"), ("SOIC127P600-8N", "added"),
+                           ("QFP50P900X900-48L", "removed"), ("SOIC127P600-8L", "removed") ])
+
+    def test_ignore_density(self):
+        diffs = diff_libraries(self.mod("L"), self.mod("N"), key=strip_density)
+        self.assertEqual([ (d.name, d.status) for d in diffs ],
+                         [ ("QFP50P900X900-48N", "changed"), ("SOIC127P600-8N", "changed") ])
+        self.assertTrue(all(len(d.pads) > 0 for d in diffs))
+
+    def test_removed(self):
+        diffs = diff_libraries(self.mod("N"), self.mod("M", self.names[:1]), key=strip_density)
+        self.assertEqual([ (d.name, d.status) for d in diffs ],
+                         [ ("QFP50P900X900-48M", "changed"), ("SOIC127P600-8N", "removed") ])
+
+    def test_pretty(self):
+        # Same geometry as a .pretty directory, plain and compressed
+        pretty = self.pretty("N")
+        self.assertEqual(diff_libraries(self.mod("N"), pretty), [])
+        self.assertEqual(diff_libraries(pretty, self.pretty("L", "gzip"),
+                                        key=strip_density)[0].status, "changed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# Tests for sharded libraries: shard names, and finding modules from the manifest
+# written by makelibs --shard.
+#
+# Run with:
+#   python -m unittest test_manifest
+#
+
+import optparse
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+import modfile
+try:
+    import makelibs
+except ImportError: # makelibs is Python 2 only
+    makelibs = None
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        if makelibs is None:
+            self.skipTest("needs makelibs")
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shard_names(self):
+        qfp = (10, 10, 0.50, 64)
+        sop = (6.00, 1.27, 4.90, 8, 1.40, "SOIC-8")
+        self.assertEqual(makelibs.shard_name("qfp", qfp, "family"), "QFP")
+        self.assertEqual(makelibs.shard_name("sop", sop, "family"), "SOIC")
+        self.assertEqual(makelibs.shard_name("qfp", qfp, "pitch"), "P050")
+        self.assertEqual(makelibs.shard_name("sop", sop, "pitch"), "P127")
+        # QFP rows have the body size, the lead span is 2mm more
+        self.assertEqual(makelibs.shard_name("qfp", qfp, "size"), "S20")
+        self.assertEqual(makelibs.shard_name("qfp", (4, 4, 0.65, 20), "size"), "S10")
+        self.assertEqual(makelibs.shard_name("sop", sop, "size"), "S10")
+        self.assertEqual(makelibs.shard_name("qfp", (40, 40, 0.5, 304), "size"), "S42")
+
+    def build(self, compress):
+        """Build a few QFP and SOP modules into two shards of each density level and
+        return the manifests and the parsed shards"""
+        options = optparse.Values({ "compress": compress, "level": None,
+                                    "pretty": False, "thumbnails": None })
+        modules = makelibs.qfp_modules()[5:8] + makelibs.sop_modules()[:3]
+        libraries = [ os.path.join(self.directory, "lib-%s" % density)
+                      for density in makelibs.densities ]
+        built = []
+        for (suffix, shard) in (("-a", modules[::2]), ("-b", modules[1::2])):
+            built.append(makelibs.build_libraries([ l + suffix for l in libraries ], shard, options))
+        manifests = []
+        parsed = {}
+        for (i, library) in enumerate(libraries):
+            makelibs.write_manifest(library + ".manifest", [ b[i] for b in built ])
+            manifests.append(library + ".manifest")
+            for b in built:
+                mod = modfile.Mod(b[i][0])
+                mod.parse()
+                mod.f.close()
+                parsed.update(zip(mod.names, mod.mods))
+        return (manifests, parsed)
+
+    def check(self, compress):
+        (manifests, parsed) = self.build(compress)
+        self.assertEqual(len(parsed), 18)
+        names = set()
+        for filename in manifests:
+            manifest = modfile.read_manifest(filename)
+            names.update(manifest)
+            for (name, (shard, offset)) in manifest.items():
+                self.assertTrue(shard.endswith(".mod" + common.compression_suffix[compress]))
+                # The offset is where the $MODULE line starts in the uncompressed text
+                f = common.open_library(shard)
+                text = "".join(f)
+                f.close()
+                self.assertTrue(text[offset:].startswith("$MODULE %s\n" % name))
+                package = modfile.read_module(manifest, name)
+                self.assertEqual(package.pad_table()[0], parsed[name].pad_table()[0])
+                self.assertEqual(package.pad_table()[2].tolist(), parsed[name].pad_table()[2].tolist())
+        self.assertEqual(names, set(parsed))
+        # By file name too
+        package = modfile.read_module(manifests[0], sorted(names)[0])
+        self.assertTrue(len(package.data) > 0)
+        self.assertRaises(KeyError, modfile.read_module, manifests[0], "QFP1-1N")
+
+    def test_plain(self):
+        self.check(None)
+
+    def test_gzip(self):
+        self.check("gzip")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+# Tests for merging .mod libraries and the name collision policies.
+#
+# Run with:
+#   python -m unittest test_modmerge
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import footprinter
+import modfile
+import modmerge
+from modmerge import resolve
+from qfp import Qfp
+from soic import Soic
+
+def generate(name):
+    generator = Qfp() if name.startswith("QFP") else Soic()
+    generator.parse_ipc_name(name)
+    return generator.generate()
+
+class ResolveTest(unittest.TestCase):
+    libraries = [ ["A", "B"], ["B", "C", "A"], ["A"] ]
+
+    def test_first(self):
+        self.assertEqual(resolve(self.libraries, "first"),
+                         [ ["A", "B"], [None, "C", None], [None] ])
+
+    def test_last(self):
+        self.assertEqual(resolve(self.libraries, "last"),
+                         [ [None, None], ["B", "C", None], ["A"] ])
+
+    def test_rename(self):
+        self.assertEqual(resolve(self.libraries, "rename"),
+                         [ ["A", "B"], ["B_2", "C", "A_2"], ["A_3"] ])
+
+    def test_rename_skips_taken(self):
+        # A_2 is already a module name, so the second A becomes A_3
+        self.assertEqual(resolve([ ["A", "A_2"], ["A"] ], "rename"),
+                         [ ["A", "A_2"], ["A_3"] ])
+
+    def test_error(self):
+        self.assertRaises(ValueError, resolve, self.libraries, "error")
+        self.assertEqual(resolve([ ["A"], ["B"] ], "error"), [ ["A"], ["B"] ])
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def library(self, filename, names):
+        filename = os.path.join(self.directory, filename)
+        f = open(filename, "w")
+        f.write("PCBNEW-LibModule-V1  T\n$INDEX\n")
+        for name in names:
+            f.write("%s\n" % name)
+        f.write("$EndINDEX\n")
+        for name in names:
+            footprinter.make_emp(f, name, generate(name), False)
+        f.write("$EndLIBRARY\n")
+        f.close()
+        return filename
+
+    def parse(self, filename):
+        mod = modfile.Mod(filename)
+        mod.read_index()
+        mod.parse()
+        mod.f.close()
+        return mod
+
+    def test_rename(self):
+        a = self.library("a.mod", ["QFP50P900X900-48N", "SOIC127P600-8N"])
+        b = self.library("b.mod", ["QFP50P900X900-48N"])
+        output = os.path.join(self.directory, "out.mod")
+        self.assertEqual(modmerge.merge_libraries([a, b], output, "rename"), (3, 0, 1))
+
+        mod = self.parse(output)
+        self.assertEqual(mod.index, ["QFP50P900X900-48N", "QFP50P900X900-48N_2", "SOIC127P600-8N"])
+        self.assertEqual(mod.names, mod.index)
+        self.assertEqual(mod.mods[0].pad_table()[2].tolist(), mod.mods[1].pad_table()[2].tolist())
+        # All the lines with the module name are renamed
+        f = open(output)
+        text = f.read()
+        f.close()
+        self.assertEqual(text.count("$MODULE QFP50P900X900-48N_2\n"), 1)
+        self.assertEqual(text.count("Li QFP50P900X900-48N_2\n"), 1)
+        self.assertEqual(text.count("$EndMODULE QFP50P900X900-48N_2\n"), 1)
+        self.assertEqual(text.count("$EndMODULE QFP50P900X900-48N\n"), 1)
+
+    def test_first(self):
+        a = self.library("a.mod", ["SOIC127P600-8N"])
+        b = self.library("b.mod", ["QFP50P900X900-48N", "SOIC127P600-8N"])
+        output = os.path.join(self.directory, "out.mod")
+        self.assertEqual(modmerge.merge_libraries([a, b], output), (2, 1, 0))
+        self.assertEqual(self.parse(output).names, ["QFP50P900X900-48N", "SOIC127P600-8N"])
+
+    def test_bad_policy(self):
+        a = self.library("a.mod", ["SOIC127P600-8N"])
+        self.assertRaises(ValueError, modmerge.merge_libraries, [a], a + ".out", "keep")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# Tests for integer nanometre geometry: Nm arithmetic, formatting against mm mode
+# and the make_emp -> Mod.parse -> make_emp round trip.
+#
+# Run with:
+#   python -m unittest test_nm
+#
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy
+import footprinter
+import modfile
+from common import Nm, Circle, Line, Pad, to_nm, to_mm
+from qfp import Qfp
+
+def qfp_package():
+    generator = Qfp()
+    generator.parse_ipc_name("QFP50P900X900-48N")
+    return generator.generate()
+
+def sexp(package):
+    return "".join(d.kicad_sexp() for d in package.placed().data)
+
+def geometry_lines(text):
+    """Return the DS, pad and description lines of legacy module text. The module
+    Po line has a time stamp and is left out."""
+    return [ l for l in text.splitlines()
+             if l.split()[:1] in (["DS"], ["Sh"], ["At"], ["Po"], ["Cd"]) and not l.startswith("Po 0 0 0 15 ") ]
+
+class NmArithmeticTest(unittest.TestCase):
+    def test_results_stay_nm(self):
+        a = Nm(1000000)
+        b = Nm(500000)
+        for v in (a + b, a - b, b - a, -a, abs(-a), 2 * a, a * 2, a * 0.5, a / 2.0, a + 1, 1 + a, 1 - a):
+            self.assertTrue(isinstance(v, Nm), repr(v))
+        self.assertEqual(a + b, 1500000)
+        self.assertEqual(a * 0.3333333, 333333)
+        self.assertEqual(a / b, 2.0)
+        self.assertTrue(isinstance(a + numpy.arange(3), numpy.ndarray))
+
+    def test_to_mm(self):
+        self.assertEqual(to_mm(Nm(1500000)), 1.5)
+        self.assertFalse(isinstance(to_mm(Nm(1500000)), Nm))
+
+class NmConvertTest(unittest.TestCase):
+    def test_round_trip(self):
+        package = qfp_package()
+        back = package.converted("nm").converted("mm")
+        self.assertEqual(sexp(back), sexp(package))
+        self.assertEqual(back.bbox, package.bbox)
+        self.assertEqual(back.courtyard, package.courtyard)
+        # Within a nanometre, nm lengths have no float noise
+        self.assertTrue(numpy.allclose(back.pad_table()[2], package.pad_table()[2], rtol=0, atol=1e-6))
+
+    def test_stream_round_trip(self):
+        generator = Qfp()
+        generator.parse_ipc_name("QFP50P900X900-48N")
+        package = generator.stream()
+        back = package.converted("nm").converted("mm")
+        self.assertTrue(numpy.allclose(back.pad_table()[2], qfp_package().pad_table()[2], rtol=0, atol=1e-6))
+
+    def test_placed_with_rotation(self):
+        nm = qfp_package().converted("nm")
+        nm.rotate(90)
+        mm = qfp_package()
+        mm.rotate(90)
+        self.assertEqual(sexp(nm), sexp(mm))
+
+    def test_render(self):
+        try:
+            import PIL
+        except ImportError:
+            self.skipTest("needs PIL")
+        (a, b) = (io.BytesIO(), io.BytesIO())
+        size_nm = footprinter.make_pil_png(a, 8, qfp_package().converted("nm"))
+        size_mm = footprinter.make_pil_png(b, 8, qfp_package())
+        self.assertEqual(size_nm, size_mm)
+        self.assertEqual(a.getvalue(), b.getvalue())
+
+class NmFormatTest(unittest.TestCase):
+    def primitives(self):
+        circle = Circle((1.2, -0.5), 0.75, 0.15)
+        line = Line((-3.75, 1.1), (2.5, -0.4), 0.2)
+        pad = Pad(7)
+        (pad.x, pad.y, pad.xsize, pad.ysize, pad.rotation) = (-4.2, 2.75, 1.3, 0.25, 90)
+        return (circle, line, pad)
+
+    def test_kicad_sexp(self):
+        for d in self.primitives():
+            self.assertEqual(d.convert(to_nm).kicad_sexp(), d.kicad_sexp())
+
+    def test_kicad_mod(self):
+        for d in self.primitives()[1:]:
+            self.assertEqual(d.convert(to_nm).kicad_mod(), d.kicad_mod())
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def round_trip(self, nm):
+        generator = Qfp()
+        generator.parse_ipc_name("QFP50P900X900-48N")
+        first = StringIO()
+        footprinter.make_emp(first, "QFP50P900X900-48N", generator.generate())
+        filename = os.path.join(self.directory, "qfp.mod")
+        f = open(filename, "w")
+        f.write(first.getvalue())
+        f.close()
+
+        mod = modfile.Mod(filename, nm=nm)
+        mod.parse()
+        mod.f.close()
+        second = StringIO()
+        footprinter.make_emp(second, mod.names[0], mod.mods[0])
+        return (geometry_lines(first.getvalue()), geometry_lines(second.getvalue()))
+
+    def test_mm(self):
+        (first, second) = self.round_trip(False)
+        self.assertEqual(first, second)
+
+    def test_nm(self):
+        (first, second) = self.round_trip(True)
+        self.assertTrue(any(l.startswith("Cd ") for l in first))
+        self.assertEqual(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
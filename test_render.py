@@ -0,0 +1,49 @@
+# Tests for the banded PNG renderer against drawing the whole image at once.
+#
+# Run with:
+#   python -m unittest test_render
+#
+
+import io
+import unittest
+
+import footprinter
+
+def bga_package(name):
+    generator = footprinter.make_generator(name)
+    generator.parse_ipc_name(name)
+    return generator.generate()
+
+class TiledPngTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest("needs PIL")
+        self.Image = Image
+
+    def pixels(self, f):
+        f.seek(0)
+        im = self.Image.open(f)
+        return (im.size, im.tobytes())
+
+    def check(self, name, scale, bandheight=64):
+        (a, b) = (io.BytesIO(), io.BytesIO())
+        footprinter.make_pil_png(a, scale, bga_package(name))
+        footprinter.make_tiled_png(b, scale, bga_package(name), bandheight)
+        self.assertEqual(self.pixels(a), self.pixels(b), (name, scale, bandheight))
+
+    def test_balls_across_bands(self):
+        self.check("BGA196C100P14X14_1500X1500N", 20)
+        self.check("BGA256C80P16X16_1400X1400N", 8)
+        self.check("BGA100C50P10X10_600X600M", 50)
+
+    def test_thin_bands(self):
+        self.check("BGA100C50P10X10_600X600M", 13, 7)
+
+    def test_no_circles(self):
+        self.check("QFP50P900X900-48N", 30, 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# Tests for PackageStream: batches, and parameter snapshots taken by the generators
+# when a stream is made.
+#
+# Run with:
+#   python -m unittest test_stream
+#
+
+import unittest
+
+import numpy
+import common
+from common import PackageStream, Pad, PadArray, batch_size
+from qfp import Qfp
+from soic import Soic
+from bga import Bga
+
+def generator(kind, name):
+    generator = kind()
+    generator.parse_ipc_name(name)
+    return generator
+
+def kicad(package):
+    return "".join(d.kicad_sexp() for d in package.placed().data)
+
+def pad_count(data):
+    return sum(len(d) if isinstance(d, PadArray) else 1 for d in data
+               if isinstance(d, (Pad, PadArray)))
+
+class BatchTest(unittest.TestCase):
+    def check_batches(self, stream):
+        batches = list(stream.batches())
+        self.assertTrue(len(batches) > 1)
+        for data in batches:
+            self.assertTrue(pad_count(data) <= batch_size)
+        # Batches are placed, and together they are the whole package
+        self.assertTrue(all(d.transform is None for data in batches for d in data))
+        placed = stream.placed()
+        self.assertEqual("".join(d.kicad_sexp() for data in batches for d in data),
+                         "".join(d.kicad_sexp() for d in placed.data))
+        return placed
+
+    def test_qfp(self):
+        # More pads than fit in one batch
+        placed = self.check_batches(generator(Qfp, "QFP40P4000X4000-304N").stream())
+        self.assertEqual(pad_count(placed.data), 304)
+
+    def test_bga(self):
+        placed = self.check_batches(generator(Bga, "BGA1024C100P32X32_3300X3300N").stream())
+        self.assertEqual(pad_count(placed.data), 1024)
+
+    def test_bbox(self):
+        stream = generator(Qfp, "QFP50P900X900-48N").stream()
+        stream.rotate(30)
+        for data in stream.batches():
+            pass
+        extents = numpy.array([ d.extent() for d in stream.placed().data ]).reshape(-1, 4)
+        self.assertTrue(numpy.allclose(stream.bbox, ((extents[:, 0].min(), extents[:, 1].min()),
+                                                     (extents[:, 2].max(), extents[:, 3].max()))))
+
+    def test_stream_is_lazy(self):
+        calls = []
+        def source():
+            calls.append(1)
+            yield [ common.Line((0, 0), (1, 1), 0.15) ]
+        stream = PackageStream(source)
+        self.assertEqual(calls, [])
+        self.assertEqual(len(stream.package().data), 1)
+        self.assertEqual(len(list(stream.batches())), 1)
+        self.assertEqual(len(calls), 2)
+
+class SnapshotTest(unittest.TestCase):
+    def check_snapshot(self, kind, name, change):
+        g = generator(kind, name)
+        stream = g.stream()
+        before = kicad(stream)
+        courtyard = stream.courtyard
+        change(g)
+        # The stream keeps the parameters it was made with
+        self.assertEqual(kicad(stream), before)
+        self.assertEqual(stream.courtyard, courtyard)
+        self.assertEqual(stream.courtyard, stream.package().courtyard)
+        self.assertNotEqual(kicad(g.stream()), before)
+
+    def test_qfp(self):
+        self.check_snapshot(Qfp, "QFP50P900X900-48N", lambda g: g.set_density("M"))
+
+    def test_soic(self):
+        def change(g):
+            g.params.termwidth = 0.3
+            g.set_density("L")
+        self.check_snapshot(Soic, "SOIC127P600-8N", change)
+
+    def test_bga(self):
+        def change(g):
+            g.params.balldiameter = 0.3
+            g.recalculate_params()
+        self.check_snapshot(Bga, "BGA100C80P10X10_900X900N", change)
+
+    def test_variants(self):
+        """Density variants share a skeleton, but match separately made packages"""
+        for (kind, name) in ((Qfp, "QFP50P900X900-48"), (Soic, "SOIC127P600-8")):
+            streams = generator(kind, name + "N").variants("LNM")
+            for (density, stream) in zip("LNM", streams):
+                g = generator(kind, name + density)
+                self.assertEqual(kicad(stream), kicad(g.generate()))
+                self.assertEqual(stream.courtyard, g.courtyard())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+# Tests for lazily composed transforms: Transform composition, Package.placed() and
+# the side of mirrored packages in the writers.
+#
+# Run with:
+#   python -m unittest test_transform
+#
+
+import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy
+import footprinter
+import panel
+from common import Transform, Package, Pad, Line, compose, rotate
+from soic import Soic
+
+def soic_package():
+    generator = Soic()
+    generator.parse_ipc_name("SOIC127P600-8N")
+    return generator.generate()
+
+class TransformTest(unittest.TestCase):
+    def test_rotated_matches_rotate(self):
+        (xs, ys) = Transform().rotated(30).apply([1.0, -2.0], [0.5, 3.0])
+        for (x, y, p) in zip(xs, ys, [(1.0, 0.5), (-2.0, 3.0)]):
+            self.assertEqual((x, y), rotate(p, 30))
+
+    def test_composition_order(self):
+        t = Transform().rotated(90).translated(10, 0)
+        (xs, ys) = t.apply([1.0], [0.0])
+        (rx, ry) = rotate((1.0, 0.0), 90)
+        self.assertAlmostEqual(xs[0], rx + 10)
+        self.assertAlmostEqual(ys[0], ry)
+        self.assertEqual(t.angle, 90)
+
+    def test_compose_none(self):
+        t = Transform().rotated(45)
+        self.assertTrue(compose(None, t) is t)
+        self.assertTrue(compose(t, None) is t)
+        self.assertTrue(compose(None, None) is None)
+
+    def test_mirror(self):
+        t = Transform().rotated(90).mirrored_x()
+        self.assertTrue(t.mirrored)
+        self.assertEqual(t.layer("F.Cu"), "B.Cu")
+        self.assertEqual(t.pad_rotation(0), 270)
+        self.assertFalse(t.mirrored_x().mirrored)
+
+    def test_pad_rotation_range(self):
+        for th in (-720, -90, 0, 90, 270, 360, 450):
+            for mirrored in (False, True):
+                t = Transform().rotated(th)
+                if mirrored:
+                    t = t.mirrored_x()
+                r = t.pad_rotation(90)
+                self.assertTrue(0 <= r < 360, (th, mirrored, r))
+
+class PlacedTest(unittest.TestCase):
+    def test_nothing_to_place(self):
+        package = Package()
+        package.data.append(Line((0, 0), (1, 1), 0.15))
+        self.assertTrue(package.placed() is package)
+
+    def test_package_and_primitive_transforms(self):
+        package = Package()
+        pad = Pad(1)
+        (pad.x, pad.y, pad.xsize, pad.ysize) = (1.0, 0.0, 0.5, 0.25)
+        pad.transform = Transform().rotated(90)
+        package.data.append(pad)
+        package.translate(5, 0)
+        placed = package.placed()
+        (x, y) = rotate((1.0, 0.0), 90)
+        self.assertAlmostEqual(placed.data[0].x, x + 5)
+        self.assertAlmostEqual(placed.data[0].y, y)
+        self.assertEqual(placed.data[0].rotation, 90)
+        # The original is left as it was
+        self.assertEqual((pad.x, pad.y), (1.0, 0.0))
+        self.assertTrue(package.data[0] is pad)
+
+    def test_same_as_rotating_twice(self):
+        a = soic_package()
+        a.rotate(90)
+        a.rotate(90)
+        b = soic_package()
+        b.rotate(180)
+        ta = a.placed().pad_table()
+        tb = b.placed().pad_table()
+        self.assertEqual(ta[0], tb[0])
+        self.assertTrue(numpy.allclose(ta[2], tb[2]))
+
+class BackSideTest(unittest.TestCase):
+    def test_side(self):
+        package = soic_package()
+        self.assertEqual(package.side(), "F")
+        package.mirror()
+        self.assertEqual(package.side(), "B")
+        # Placed packages have no transform left
+        self.assertEqual(package.placed().side(), "B")
+
+    def test_kicad_mod(self):
+        package = soic_package()
+        package.mirror()
+        f = StringIO()
+        footprinter.make_kicad_mod(f, "SOIC127P600-8N", package)
+        text = f.getvalue()
+        self.assertTrue(text.startswith("(module SOIC127P600-8N (layer B.Cu)"))
+        self.assertFalse("F." in text)
+        self.assertEqual(text.count("(justify mirror)"), 2)
+
+    def test_emp(self):
+        package = soic_package()
+        package.mirror()
+        f = StringIO()
+        footprinter.make_emp(f, "SOIC127P600-8N", package, False)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[1].split()[4], "0")
+        for l in lines:
+            if l.startswith("T"):
+                self.assertEqual(l.split()[7:10], ["M", l.split()[8], "20"])
+            elif l.startswith("DS"):
+                self.assertEqual(l.split()[6], "20")
+
+    def test_panel(self):
+        back = soic_package()
+        back.mirror()
+        p = panel.Panel()
+        p.place(p.add_footprint("SOIC127P600-8N", soic_package()), 0, 0)
+        p.place(p.add_footprint("SOIC127P600-8N-B", back), 10, 0, 90)
+        f = StringIO()
+        p.write_kicad_pcb(f)
+        modules = f.getvalue().split("  (module ")[1:]
+        texts = [ [ l for l in m.splitlines() if "fp_text" in l ] for m in modules ]
+        self.assertTrue(modules[0].startswith("SOIC127P600-8N (layer F.Cu)"))
+        self.assertTrue(all("(layer F.SilkS)" in l for l in texts[0]))
+        self.assertFalse("mirror" in modules[0])
+        self.assertTrue(modules[1].startswith("SOIC127P600-8N-B (layer B.Cu)"))
+        self.assertTrue(all("(layer B.SilkS)" in l for l in texts[1]))
+        self.assertEqual(len(texts[1]), 2)
+        self.assertEqual(modules[1].count("(justify mirror)"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()